@@ -47,7 +47,6 @@ a specific page. Lastly, :doc:`plugins/index` can be used to easily share custom
 between documentation projects.
 """
 
-import hashlib
 import json
 from pathlib import Path
 import re
@@ -66,7 +65,7 @@ from sphinx.transforms import SphinxTransform
 from sphinx.config import Config
 from sphinx.util.docutils import SphinxDirective
 from sphinx.util.logging import getLogger
-from .validators import Social_Cards
+from .validators import Social_Cards, Output_Format, clear_derived_values
 from .validators.contexts import (
     JinjaContexts,
     Page,
@@ -74,6 +73,23 @@ from .validators.contexts import (
     Cards_Layout_Options,
 )
 from .generator import CardGenerator
+from .bundle import ResourceBundle
+from .fetch import Fetcher
+from .cache import CACHE_NAMESPACES, cache_path, evict, install_card, remove_legacy_files
+from .batch import RenderJob, render_cached, queue_job, purge_jobs, merge_jobs, render_jobs
+from .dependencies import BUILD_CONTEXTS, context_digests, inputs_digest, layouts_digest
+from .fonts import FontSourceManager
+from .manifest import (
+    CardRecord,
+    discard_previous_records,
+    get_manifest,
+    get_previous_records,
+    get_read_docs,
+    record_card,
+    purge_records,
+    merge_records,
+    prune_cards,
+)
 from .metadata import (
     get_doc_meta_data,
     complete_doc_meta_data,
@@ -84,6 +100,12 @@ from .plugins import SPHINX_SOCIAL_CARDS_CONFIG_KEY, SPHINX_SOCIAL_CARDS_PLUGINS
 
 LOGGER = getLogger(__name__)
 _CARD_IMG_CHECK = re.compile(r"(?:property=og|name=twitter):image")
+# the configs (with defaults set) of the social-card directives mapped by the JSON of
+# their source; these are reset when the config is loaded at the start of each build
+_DIRECTIVE_CONFIGS: dict[str, Social_Cards] = {}
+# the contexts shared by all cards (see `_get_build_contexts()`); these are also reset
+# when the config is loaded
+_BUILD_CONTEXTS: dict[str, Any] = {}
 
 config_parser: TypeAdapter[Social_Cards] = TypeAdapter(Social_Cards)
 layout_ctx_parser: TypeAdapter[Cards_Layout_Options] = TypeAdapter(Cards_Layout_Options)
@@ -93,7 +115,15 @@ def _load_config(app: Sphinx, config: Config):
     assert hasattr(config, "social_cards"), f"config not found: {dir(config)}"
     user_config: dict[str, Any] = getattr(config, "social_cards")
     # LOGGER.info("config loaded: %r", user_config)
+    clear_derived_values()
+    _DIRECTIVE_CONFIGS.clear()
+    _BUILD_CONTEXTS.clear()
+    layouts_digest.cache_clear()
     card_config: Social_Cards = config_parser.validate_python(user_config)
+    # remote resources (including the default logo) are fetched according to the offline mode
+    Fetcher.bundle = ResourceBundle(Path(app.srcdir, card_config.cache_dir))
+    if Fetcher.mode != "record":
+        Fetcher.mode = "offline" if card_config.offline else "online"
     # LOGGER.info("layout options: %r", card_config.cards_layout_options)
     card_config.set_defaults(app.srcdir, config)
     # LOGGER.info("config parsed: %r", card_config)
@@ -101,6 +131,81 @@ def _load_config(app: Sphinx, config: Config):
     CardGenerator.doc_src = app.srcdir
 
 
+def _get_config_context(config: Config, conf: Social_Cards) -> ConfigCtx:
+    site_url = urlparse(conf.site_url)
+    return ConfigCtx(
+        docstitle=getattr(config, "project", ""),
+        theme=getattr(config, "html_theme_options", {}),
+        site_url=site_url.netloc + site_url.path,
+        author=getattr(config, "author", ""),
+        language=cast(str, getattr(config, "language", "en")),
+        today=getattr(config, "today", None),
+        site_description=conf.description,
+    )
+
+
+def _get_build_contexts(app: Sphinx) -> dict[str, Any]:
+    """Get the (dumped) jinja contexts that are the same for every document.
+
+    These are validated and dumped once per build, and every card's context refers to
+    the same values. Only the ``page`` context is created for each document.
+    """
+    if not _BUILD_CONTEXTS:
+        conf: Social_Cards = app.config[SPHINX_SOCIAL_CARDS_CONFIG_KEY]
+        # resolve the default font first, so the layout context is the same for every card
+        assert conf.cards_layout_options.font is not None
+        FontSourceManager.resolve(conf.cards_layout_options.font, conf.cache_dir)
+        contexts = JinjaContexts(
+            layout=conf.cards_layout_options,
+            config=_get_config_context(app.config, conf),
+            plugin=getattr(app.env, SPHINX_SOCIAL_CARDS_PLUGINS_ENV_KEY, {}),
+        )
+        _BUILD_CONTEXTS.update(contexts.model_dump(exclude={"page"}))
+    return _BUILD_CONTEXTS
+
+
+def _is_unchanged(factory: CardGenerator, uri: str, record: CardRecord, outdir: str | Path) -> bool:
+    """Are the inputs of a previously generated card the same for the given factory?"""
+    if record.img_size is None or not Path(outdir, uri).exists():
+        return False
+    if context_digests(factory.context, record.context) != record.context:
+        return False
+    return factory.get_inputs_digest(record.resources) == record.inputs
+
+
+def _find_outdated_cards(app: Sphinx, env: BuildEnvironment) -> set[str]:
+    """Find the documents whose cards depend on a build-wide input that has changed."""
+    conf: Social_Cards = app.config[SPHINX_SOCIAL_CARDS_CONFIG_KEY]
+    records = [record for record in get_manifest(env).values() if record.inputs]
+    if not records:
+        return set()
+    context = _get_build_contexts(app)
+    search_path = CardGenerator.get_layout_search_path(conf)
+    outdated: set[str] = set()
+    for record in records:
+        # the page context can only change if the document changed
+        paths = {path: val for path, val in record.context.items() if path[0] in BUILD_CONTEXTS}
+        if context_digests(context, paths) != paths:
+            outdated.add(record.docname)
+        elif inputs_digest(conf, search_path, record.resources) != record.inputs:
+            outdated.add(record.docname)
+    return outdated
+
+
+def _get_directive_config(app: Sphinx, conf_src: dict[str, Any]) -> Social_Cards:
+    """Get a (mutable) copy of the validated config for a social-card directive.
+
+    Directives with the same ``conf_src`` share the work of validating the config and
+    setting its defaults.
+    """
+    key = json.dumps(conf_src, sort_keys=True, default=str)
+    if key not in _DIRECTIVE_CONFIGS:
+        conf: Social_Cards = config_parser.validate_python(conf_src)
+        conf.set_defaults(app.srcdir, app.config)
+        _DIRECTIVE_CONFIGS[key] = conf
+    return _DIRECTIVE_CONFIGS[key].model_copy(deep=True)
+
+
 def _assert_plugin_context(app: Sphinx):
     if not hasattr(app.env, SPHINX_SOCIAL_CARDS_PLUGINS_ENV_KEY):
         setattr(app.env, SPHINX_SOCIAL_CARDS_PLUGINS_ENV_KEY, {})
@@ -116,19 +221,24 @@ def flush_cache(
     ext_config: Social_Cards = app.config[SPHINX_SOCIAL_CARDS_CONFIG_KEY]
     assert isinstance(ext_config.cache_dir, (str, Path))
     cache_root = Path(app.srcdir, ext_config.cache_dir)
-    # flush all resized images
-    resized_images = cache_root.glob("*.png")
-    for img in resized_images:
-        img.unlink()
-    # removing example images (from directive dry-runs)
-    cache_root = cache_root / ".social_card_examples"
+    remove_legacy_files(cache_root)
+    # the files referenced by the (already loaded) config must not be evicted
+    logo = ext_config.cards_layout_options.logo
+    keep = [logo.image] if logo is not None and logo.image is not None else []
+    for namespace in CACHE_NAMESPACES:
+        evict(cache_root, namespace, keep)
+    # removing example images (from directive dry-runs) of the changed documents
+    examples_root = cache_path(cache_root, "examples")
     for doc_name in added | changed | removed:
         parts = doc_name.split("/")
         basename = parts[-1]
-        ex_images = Path(cache_root, *parts[:-1]).glob(f"{basename}-*.png")
+        ex_images = Path(examples_root, *parts[:-1]).glob(f"{basename}-*.*")
         for img in ex_images:
             img.unlink()
-    return []
+    outdated = _find_outdated_cards(app, env) - removed
+    if outdated:
+        LOGGER.info("the social cards of %d document(s) are outdated", len(outdated))
+    return sorted(outdated)
 
 
 class SocialCardTransform(SphinxTransform):
@@ -141,10 +251,8 @@ class SocialCardTransform(SphinxTransform):
         builder = self.app.builder
         if self.document is None or not isinstance(builder, StandaloneHTMLBuilder):
             return
-        doc_path = self.env.doc2path(self.env.docname, base=False)
-        if conf.enable and (doc_path in conf.cards_exclude and doc_path not in conf.cards_include):
-            return
-        elif not conf.enable and doc_path not in conf.cards_include:
+        get_read_docs(self.env).add(self.env.docname)
+        if not conf.generates_card(self.env.doc2path(self.env.docname, base=False)):
             return
 
         meta_data = get_doc_meta_data(self.document)
@@ -173,29 +281,30 @@ class SocialCardTransform(SphinxTransform):
                 return
 
         # generate the image
-        card_contexts = JinjaContexts(
-            layout=conf.cards_layout_options,
-            config=ConfigCtx(
-                docstitle=getattr(self.config, "project", ""),
-                theme=getattr(self.config, "html_theme_options", {}),
-                site_url=ctx_url,
-                author=getattr(self.config, "author", ""),
-                language=cast(str, getattr(self.config, "language", "en")),
-                today=getattr(self.config, "today", None),
-                site_description=conf.description,
-            ),
-            page=Page(
-                meta=page_meta,
-                title=page_title,
-                canonical_url="/".join([ctx_url, page_uri]),
-                is_homepage=self.env.docname == getattr(self.config, "master_doc"),
-            ),
-            plugin=getattr(self.env, SPHINX_SOCIAL_CARDS_PLUGINS_ENV_KEY, {}),
+        page = Page(
+            meta=page_meta,
+            title=page_title,
+            canonical_url="/".join([ctx_url, page_uri]),
+            is_homepage=self.env.docname == getattr(self.config, "master_doc"),
         )
+        card_contexts = {**_get_build_contexts(self.app), "page": page.model_dump()}
         factory = CardGenerator(config=conf, context=card_contexts)
-        factory.parse_layout()
-        card = factory.render_card()
-        file_hash = hashlib.sha256(card.bits()).hexdigest()[:16]
+        card: Path | None = None
+        img_size: tuple[int, int] | None = None
+        previous = get_previous_records(self.env).pop(self.env.docname, None)
+        if previous is not None and _is_unchanged(factory, *previous, self.app.outdir):
+            # the card's inputs are unchanged, so the existing image is reused as is
+            record: CardRecord | None = previous[1]
+            assert record is not None
+            cache_key, file_hash, img_size = record.cache_key, record.hash, record.img_size
+        else:
+            record = None
+            factory.parse_layout()
+            cache_key = factory.get_cache_key()
+            if conf.hash_layout:
+                file_hash = cache_key[:16]
+            else:
+                card, file_hash = render_cached(factory, cache_key)
 
         # add the updated meta_data
         img_uri, added_meta_data = complete_doc_meta_data(
@@ -206,13 +315,37 @@ class SocialCardTransform(SphinxTransform):
             conf,
             self.env.docname,
             file_hash,
+            img_size,
         )
         assert img_uri is not None
 
         # save the image (& meta_data)
         img_path = Path(self.app.outdir, conf.path, img_uri)
-        img_path.parent.mkdir(parents=True, exist_ok=True)
-        card.save(str(img_path))
+        if card is None and img_path.exists():
+            pass  # the card is named after its layout, so the existing image is unchanged
+        elif conf.deferred:
+            job = RenderJob(
+                self.env.docname, conf.model_copy(), card_contexts, cache_key, str(img_path)
+            )
+            queue_job(self.env, job)
+        else:
+            if card is None:
+                card, _ = render_cached(factory, cache_key)
+            install_card(card, img_path)
+        if record is None:
+            resources = factory.get_resources()
+            record = CardRecord(
+                docname=self.env.docname,
+                hash=file_hash,
+                size=img_path.stat().st_size if img_path.exists() else None,
+                layout=conf.cards_layout,
+                cache_key=cache_key,
+                resources=resources,
+                context=factory.get_dependencies(),
+                inputs=factory.get_inputs_digest(resources),
+                img_size=(conf._parsed_layout.size.width, conf._parsed_layout.size.height),
+            )
+        record_card(self.env, self.app.outdir, img_path, record)
         add_doc_meta_data(self.document, added_meta_data)
 
 
@@ -252,7 +385,7 @@ class SocialCardDirective(SphinxDirective):
             self.options["hide-conf"] = True
         else:
             conf_src.update(cast(dict, json.loads("".join(self.arguments))))
-        conf: Social_Cards = config_parser.validate_python(conf_src)
+        conf = _get_directive_config(self.env.app, conf_src)
 
         dry_run = "dry-run" in self.options
         valid_conf: Social_Cards = getattr(self.config, SPHINX_SOCIAL_CARDS_CONFIG_KEY)
@@ -322,9 +455,6 @@ class SocialCardDirective(SphinxDirective):
             plugin=getattr(self.env, SPHINX_SOCIAL_CARDS_PLUGINS_ENV_KEY, {}),
         )
 
-        # set defaults after creating nodes to display config & meta_data
-        conf.set_defaults(self.env.app.srcdir, self.config)
-
         factory = CardGenerator(context=contexts, config=conf)
 
         # render layout overrides (if any)
@@ -340,10 +470,16 @@ class SocialCardDirective(SphinxDirective):
                     container_node += layout_block
         factory.parse_layout(layout_src)
 
-        # generate the image
-        img = factory.render_card()
-        file_hash = hashlib.sha256(img.bits()).hexdigest()[:16]
-        img_name = f"{self.env.docname}-{file_hash}.png"
+        # generate the image (unless it can be deferred)
+        cache_key = factory.get_cache_key()
+        defer = conf.deferred and not dry_run
+        img: Path | None = None
+        if conf.hash_layout:
+            file_hash = cache_key[:16]
+        else:
+            img, file_hash = render_cached(factory, cache_key)
+        suffix = cast(Output_Format, conf.output_format).encoder.suffix
+        img_name = f"{self.env.docname}-{file_hash}{suffix}"
 
         # save image; path (& meta_data injection) depends on `dry-run` option
         output_path: Path | str = Path(self.env.app.outdir, conf.path)
@@ -352,7 +488,7 @@ class SocialCardDirective(SphinxDirective):
             uri_parts = Path(img_name).parts
             ref_uri = "../" * (len(uri_parts) - 1) + f"_images/{uri_parts[-1]}"
             ref_node = docutils.nodes.reference(refuri=ref_uri)
-            img_name = str(Path(conf.cache_dir, ".social_card_examples", img_name))
+            img_name = str(Path(cache_path(conf.cache_dir, "examples"), img_name))
             img_node = docutils.nodes.image(
                 "",
                 uri="../" * (len(uri_parts) - 1) + str(Path(img_name).relative_to(self.env.srcdir)),
@@ -379,8 +515,26 @@ class SocialCardDirective(SphinxDirective):
                 return []  # this directive is incompatible with non-html builders
             add_doc_meta_data(self.state.document, added_meta_data)
         img_path = Path(output_path, img_name)
-        img_path.parent.mkdir(parents=True, exist_ok=True)
-        img.save(str(img_path))
+        if img is None and img_path.exists():
+            pass  # the card is named after its layout, so the existing image is unchanged
+        elif defer:
+            job = RenderJob(self.env.docname, conf, contexts, cache_key, str(img_path))
+            queue_job(self.env, job)
+        else:
+            if img is None:
+                img, _ = render_cached(factory, cache_key)
+            install_card(img, img_path)
+        if not dry_run:
+            record = CardRecord(
+                docname=self.env.docname,
+                hash=file_hash,
+                size=img_path.stat().st_size if img_path.exists() else None,
+                layout=conf.cards_layout if layout_src is None else None,
+                cache_key=cache_key,
+                resources=factory.get_resources(),
+                context=factory.get_dependencies(),
+            )
+            record_card(self.env, self.env.app.outdir, img_path, record)
 
         self.set_source_info(container_node)
         self.add_name(container_node)
@@ -437,10 +591,19 @@ def setup(app: Sphinx):
     app.connect("config-inited", _load_config)
     app.connect("builder-inited", _assert_plugin_context, priority=999)
     app.connect("env-get-outdated", flush_cache)
+    app.connect("env-purge-doc", purge_jobs)
+    app.connect("env-merge-info", merge_jobs)
+    app.connect("env-purge-doc", purge_records)
+    app.connect("env-merge-info", merge_records)
+    app.connect("env-updated", discard_previous_records)
+    app.connect("env-updated", render_jobs)
+    app.connect("build-finished", prune_cards)
     app.add_directive("social-card", SocialCardDirective)
     app.add_directive("image-generator", CardGeneratorDirective)
 
     return {
+        # increment this when the data stored in the build environment changes
+        "env_version": 1,
         "parallel_read_safe": True,
         "parallel_write_safe": True,
     }
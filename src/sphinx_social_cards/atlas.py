@@ -0,0 +1,66 @@
+"""A process-wide cache of pre-rendered layers.
+
+Most layouts begin with layers that are the same for every page (a background, a logo,
+the site's name). When a card begins with the same layers as the previous card (that
+began with the same layer), those layers are composited once and the composite is used
+as the starting canvas for subsequent cards.
+"""
+
+from PySide6.QtGui import QImage
+
+from .cache import LRUCache
+
+
+class LayerAtlas:
+    """Composites of leading layers, keyed by the hashes of the composited layers."""
+
+    #: The maximum number of composites kept in memory. Use 0 to disable the atlas.
+    max_entries: int = 8
+    _composites: LRUCache[tuple[str, ...], QImage] = LRUCache()
+    # maps a card's first layer hash to the layer hashes of the last card starting with it
+    _previous: LRUCache[str, tuple[str, ...]] = LRUCache()
+
+    @classmethod
+    def get(cls, digests: tuple[str, ...]) -> tuple[int, QImage | None]:
+        """Get the composite of the most leading layers that are in the atlas.
+
+        Returns the number of layers in the composite and a copy of the composite
+        (which can be painted on). If no leading layers are cached, then this returns
+        :python:`(0, None)`.
+        """
+        for count in range(len(digests), 0, -1):
+            composite = cls._composites.get(digests[:count])
+            if composite is not None:
+                return count, composite.copy()
+        return 0, None
+
+    @classmethod
+    def shared_prefix(cls, digests: tuple[str, ...]) -> int:
+        """Get the number of leading layers that are the same as the previous card (that
+        began with the same layer). The given ``digests`` are remembered for the next call.
+        """
+        if not digests or cls.max_entries <= 0:
+            return 0
+        previous = cls._previous.pop(digests[0]) or ()
+        cls._previous.put(digests[0], digests)
+        cls._previous.evict(cls.max_entries)
+        count = 0
+        for prev, current in zip(previous, digests):
+            if prev != current:
+                break
+            count += 1
+        return count
+
+    @classmethod
+    def put(cls, digests: tuple[str, ...], composite: QImage):
+        """Store (a copy of) the composite of the layers identified by ``digests``."""
+        if cls.max_entries <= 0:
+            return
+        cls._composites.put(digests, composite.copy())
+        cls._composites.evict(cls.max_entries)
+
+    @classmethod
+    def clear(cls):
+        """Discard all composites."""
+        cls._composites.clear()
+        cls._previous.clear()
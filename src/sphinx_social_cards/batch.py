@@ -0,0 +1,164 @@
+"""Deferred (batch) rendering of social cards.
+
+When `defer_rendering <Social_Cards.defer_rendering>` is enabled, cards are not rendered
+while the documents are read. Instead, a `RenderJob` is queued in the build environment
+for each card, and all queued jobs are rendered together after all documents are read.
+If `render_workers <Social_Cards.render_workers>` is greater than 1, then the queued
+jobs are rendered by a pool of worker processes.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Literal, NamedTuple, cast
+
+from PySide6.QtGui import QFontDatabase
+from sphinx.application import Sphinx
+from sphinx.environment import BuildEnvironment
+from sphinx.util.logging import getLogger
+
+from .bundle import ResourceBundle
+from .cache import RenderCache, install_card
+from .fonts import ensure_qt_app
+from .generator import CardGenerator
+from .manifest import update_card_size
+from .encoders import encode_card
+from .fetch import Fetcher
+from .plugins import SPHINX_SOCIAL_CARDS_CONFIG_KEY
+from .validators import Social_Cards, Output_Format
+from .validators.contexts import JinjaContexts
+
+LOGGER = getLogger(__name__)
+_JOBS_ENV_KEY = "sphinx_social_cards_jobs"
+
+
+class RenderJob(NamedTuple):
+    """The information needed to render a card at a later time."""
+
+    #: The name of the document that uses the card.
+    docname: str
+    #: The config used to render the card. This includes the card's validated layout.
+    config: Social_Cards
+    #: The jinja contexts (or their dumped values) used to render the card's layout.
+    context: JinjaContexts | dict[str, Any]
+    #: The key that identifies the card in the `RenderCache`.
+    cache_key: str
+    #: The path to which the rendered card is saved.
+    img_path: str
+
+
+def render_cached(factory: CardGenerator, cache_key: str) -> tuple[Path, str]:
+    """Get the path to a rendered card image and its hash. The card is only rendered if
+    it is not already in the `RenderCache`."""
+    render_cache = RenderCache(factory.config.cache_dir)
+    suffix = cast(Output_Format, factory.config.output_format).encoder.suffix
+    cached = render_cache.get(cache_key, suffix)
+    if cached is not None:
+        return cached
+    data, file_hash = _render(factory)
+    return render_cache.put(cache_key, data, file_hash, suffix), file_hash
+
+
+def _render(factory: CardGenerator) -> tuple[bytes, str]:
+    card = factory.render_card()
+    output_format = cast(Output_Format, factory.config.output_format)
+    data = encode_card(card, output_format.format, output_format.quality)
+    return data, hashlib.sha256(card.bits()).hexdigest()[:16]
+
+
+def _init_worker(
+    doc_src: str,
+    fetch_mode: Literal["online", "record", "offline"],
+    bundle: ResourceBundle | None,
+):
+    # each worker process needs its own QGuiApplication
+    ensure_qt_app()
+    QFontDatabase.families()  # populates the font database
+    CardGenerator.doc_src = doc_src
+    # spawned processes do not inherit the Fetcher's state from the builder's process
+    Fetcher.mode = fetch_mode
+    Fetcher.bundle = bundle
+
+
+def render_job(job: RenderJob) -> tuple[bytes, str]:
+    """Render a queued job. Returns the encoded card image and a hash of its pixels.
+
+    This is the entrypoint used by worker processes.
+    """
+    return _render(CardGenerator(job.context, job.config))
+
+
+def get_jobs(env: BuildEnvironment) -> dict[str, RenderJob]:
+    """Get the queued jobs (mapped by their output path) from the build environment."""
+    if not hasattr(env, _JOBS_ENV_KEY):
+        setattr(env, _JOBS_ENV_KEY, {})
+    return getattr(env, _JOBS_ENV_KEY)
+
+
+def queue_job(env: BuildEnvironment, job: RenderJob):
+    """Add a job to the queue of cards to be rendered."""
+    get_jobs(env)[job.img_path] = job
+
+
+def purge_jobs(app: Sphinx, env: BuildEnvironment, docname: str):
+    jobs = get_jobs(env)
+    for img_path in [k for k, job in jobs.items() if job.docname == docname]:
+        del jobs[img_path]
+
+
+def merge_jobs(app: Sphinx, env: BuildEnvironment, docnames: set[str], other: BuildEnvironment):
+    # collect jobs queued by parallel readers
+    get_jobs(env).update(get_jobs(other))
+
+
+def render_jobs(app: Sphinx, env: BuildEnvironment) -> list[str]:
+    """Render all queued jobs. Jobs that share a `cache_key <RenderJob.cache_key>` are
+    only rendered once, and jobs already in the `RenderCache` are not rendered at all."""
+    jobs = get_jobs(env)
+    if not jobs:
+        return []
+    cards: dict[str, Path] = {}
+    pending: dict[str, RenderJob] = {}
+    for job in jobs.values():
+        if job.cache_key in cards or job.cache_key in pending:
+            continue
+        suffix = cast(Output_Format, job.config.output_format).encoder.suffix
+        cached = RenderCache(job.config.cache_dir).get(job.cache_key, suffix)
+        if cached is not None:
+            cards[job.cache_key] = cached[0]
+        else:
+            pending[job.cache_key] = job
+
+    conf: Social_Cards = getattr(app.config, SPHINX_SOCIAL_CARDS_CONFIG_KEY)
+    workers = min(conf.render_workers, len(pending))
+    LOGGER.info(
+        "rendering %d social cards (%d cached) with %d process(es)",
+        len(pending),
+        len(cards),
+        max(1, workers),
+    )
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(CardGenerator.doc_src, Fetcher.mode, Fetcher.bundle),
+        )
+    try:
+        mapper = pool.map if pool is not None else map
+        results = mapper(render_job, pending.values())
+        for job, (data, img_hash) in zip(pending.values(), results):
+            render_cache = RenderCache(job.config.cache_dir)
+            suffix = cast(Output_Format, job.config.output_format).encoder.suffix
+            cards[job.cache_key] = render_cache.put(job.cache_key, data, img_hash, suffix)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    for img_path, job in jobs.items():
+        install_card(cards[job.cache_key], Path(img_path))
+        update_card_size(env, app.outdir, Path(img_path))
+    jobs.clear()
+    return []
@@ -0,0 +1,102 @@
+"""A versioned bundle of the remote resources used to generate social cards.
+
+The bundle is stored in the ``bundle`` subfolder of the `cache_dir
+<Social_Cards.cache_dir>`. It holds every font, remote image, and plugin context (REST
+API response) that was requested while the bundle was recorded. Builds can then use
+the `offline <Social_Cards.offline>` option to only read these resources from the
+bundle (without any network access).
+
+To record the bundle, run this module with the path to the documentation's source
+(the folder containing conf.py):
+
+.. code-block:: shell
+
+    python -m sphinx_social_cards.bundle docs
+"""
+
+import argparse
+import hashlib
+import json
+from pathlib import Path
+import tempfile
+import time
+from typing import Mapping
+
+from .cache import CACHE_VERSION, atomic_write, cache_path
+
+#: The version of the bundle's format. A bundle of a different version is not used.
+BUNDLE_VERSION = 1
+# the response headers saved in the bundle
+_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Link")
+
+
+class ResourceBundle:
+    """A store of responses (mapped by the requested URL)."""
+
+    def __init__(self, cache_dir: str | Path):
+        self.root = Path(cache_path(cache_dir, "bundle"), f"v{BUNDLE_VERSION}")
+
+    def _entry_path(self, url: str) -> Path:
+        return Path(self.root, hashlib.sha256(url.encode("utf-8")).hexdigest()[:32])
+
+    def get(self, url: str) -> tuple[bytes, dict[str, str]] | None:
+        """Get the content and headers of the response saved for the ``url`` (if any)."""
+        entry = self._entry_path(url)
+        info_path = entry.with_suffix(".json")
+        if not info_path.exists():
+            return None
+        info = json.loads(info_path.read_text(encoding="utf-8"))
+        return entry.read_bytes(), info["headers"]
+
+    def put(self, url: str, content: bytes, headers: Mapping[str, str]):
+        """Save the content and headers of a response for the ``url``."""
+        entry = self._entry_path(url)
+        atomic_write(entry, content)
+        info = {
+            "url": url,
+            "headers": {key: headers[key] for key in _HEADERS if key in headers},
+        }
+        # the info file is written last, so an interrupted write is not a valid entry
+        atomic_write(entry.with_suffix(".json"), json.dumps(info).encode())
+
+    def write_info(self):
+        """Save the information that identifies the bundle."""
+        info = {
+            "version": BUNDLE_VERSION,
+            "extension": CACHE_VERSION,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        atomic_write(Path(self.root, "bundle.json"), json.dumps(info, indent=2).encode())
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m sphinx_social_cards.bundle",
+        description="Record the remote resources used to generate social cards.",
+    )
+    parser.add_argument("sourcedir", help="The path to the documentation's source.")
+    parser.add_argument("-b", "--builder", default="html", help="The builder to use.")
+    args = parser.parse_args(argv)
+
+    from sphinx.application import Sphinx
+    from .fetch import Fetcher
+
+    # every card is generated, so every resource that the layouts use is requested
+    Fetcher.mode = "record"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        app = Sphinx(
+            args.sourcedir,
+            args.sourcedir,
+            str(Path(tmp_dir, "out")),
+            str(Path(tmp_dir, "doctrees")),
+            args.builder,
+            freshenv=True,
+        )
+        app.build(force_all=True)
+    assert Fetcher.bundle is not None
+    Fetcher.bundle.write_info()
+    print(f"Recorded the social cards' resource bundle in {Fetcher.bundle.root}")
+
+
+if __name__ == "__main__":
+    main()
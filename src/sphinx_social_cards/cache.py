@@ -0,0 +1,279 @@
+"""A persistent cache of rendered social card images (and the data used to render them).
+
+The `cache_dir <Social_Cards.cache_dir>` is divided into namespaces (see
+`CACHE_NAMESPACES`). Each namespace is a subfolder with its own eviction policy.
+
+Cards are stored in the ``renders`` namespace using a key that identifies everything
+that is used to render the card. So, a card is only rendered if its layout, fonts,
+images, or this package's version has changed.
+
+The process-wide caches kept in memory (of fonts, images, and canvases) are bounded with
+an `LRUCache`.
+"""
+
+from collections import OrderedDict
+import hashlib
+from importlib.metadata import version as get_version, PackageNotFoundError
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import Callable, Generic, Hashable, Iterable, NamedTuple, TypeVar
+from urllib.parse import urlparse, quote
+
+try:
+    CACHE_VERSION = get_version("sphinx-social-cards")
+except PackageNotFoundError:  # pragma: no cover
+    CACHE_VERSION = "0.0.0"
+
+_FILE_DIGESTS: dict[tuple[str, int, int], str] = {}
+_MiB = 1024 * 1024
+_K = TypeVar("_K", bound=Hashable)
+_V = TypeVar("_V")
+
+
+class CacheNamespace(NamedTuple):
+    """A subfolder of the `cache_dir <Social_Cards.cache_dir>` and the policy used to
+    evict its entries.
+
+    An entry is a group of files that share the same name (excluding the suffix and the
+    ``.json`` suffix of a sidecar file). The time an entry was last used is the latest
+    modification time of its files.
+    """
+
+    #: The name of the subfolder.
+    folder: str
+    #: The age (in seconds) after which an entry is evicted. :python:`None` means the
+    #: entries never expire.
+    max_age: float | None = None
+    #: The total size (in bytes) of entries kept. The least recently used entries are
+    #: evicted to stay under this limit. :python:`None` means the size is not limited.
+    max_bytes: int | None = None
+
+
+#: The namespaces in the `cache_dir <Social_Cards.cache_dir>`.
+CACHE_NAMESPACES: dict[str, CacheNamespace] = {
+    # remote images are downloaded again (when needed) after a week
+    "downloads": CacheNamespace("downloads", max_age=7 * 24 * 60 * 60, max_bytes=64 * _MiB),
+    # fonts may be checked into a git repository, so they are never evicted
+    "fonts": CacheNamespace("fonts"),
+    "resized": CacheNamespace("resized", max_bytes=128 * _MiB),
+    "renders": CacheNamespace("renders", max_bytes=256 * _MiB),
+    # images generated by the social-card directive's dry-run option are removed when
+    # the document that generated them is changed (see `flush_cache()`)
+    "examples": CacheNamespace(".social_card_examples"),
+    # the resources recorded for offline builds (see `bundle.ResourceBundle`)
+    "bundle": CacheNamespace("bundle"),
+}
+
+
+def cache_path(cache_dir: str | Path, namespace: str) -> Path:
+    """Get the path to a namespace in the ``cache_dir``."""
+    return Path(cache_dir, CACHE_NAMESPACES[namespace].folder)
+
+
+def download_path(cache_dir: str | Path, url: str) -> Path:
+    """Get the path used to cache a file downloaded from the given ``url``."""
+    file_name = Path(cache_path(cache_dir, "downloads"), quote(urlparse(url).path, safe="."))
+    if not file_name.suffix:
+        file_name = file_name.with_suffix(".png")
+    return file_name
+
+
+def touch(file_path: Path):
+    """Mark a cache entry as recently used."""
+    try:
+        os.utime(file_path)
+    except OSError:
+        pass
+
+
+def evict(cache_dir: str | Path, namespace: str, keep: Iterable[str | Path] = ()) -> int:
+    """Evict the expired (and least recently used) entries in a namespace according to
+    its `CacheNamespace` policy. Returns the number of entries evicted.
+
+    The entries of the files in ``keep`` (eg. files referenced by the config) are never
+    evicted."""
+    policy = CACHE_NAMESPACES[namespace]
+    root = cache_path(cache_dir, namespace)
+    if (policy.max_age is None and policy.max_bytes is None) or not root.is_dir():
+        return 0
+    kept = {Path(file_path).resolve() for file_path in keep}
+    groups: dict[Path, list[tuple[Path, os.stat_result]]] = {}
+    for file_path in root.rglob("*"):
+        if file_path.is_file():
+            entry = file_path.with_suffix("") if file_path.suffix == ".json" else file_path
+            groups.setdefault(entry.with_suffix(""), []).append((file_path, file_path.stat()))
+    entries = sorted(
+        (
+            max(stat.st_mtime for _, stat in files),
+            sum(stat.st_size for _, stat in files),
+            [file_path for file_path, _ in files],
+        )
+        for files in groups.values()
+    )
+    total = sum(size for _, size, _ in entries)
+    now = time.time()
+    evicted = 0
+    for last_used, size, files in entries:  # least recently used first
+        expired = policy.max_age is not None and now - last_used > policy.max_age
+        if not expired and (policy.max_bytes is None or total <= policy.max_bytes):
+            break
+        if any(file_path.resolve() in kept for file_path in files):
+            continue
+        for file_path in files:
+            file_path.unlink(missing_ok=True)
+        total -= size
+        evicted += 1
+    return evicted
+
+
+def remove_legacy_files(cache_dir: str | Path) -> int:
+    """Remove the files that older versions of this extension saved directly in the
+    ``cache_dir`` (before it was split into namespaces): resized images (``*.png``) and
+    downloaded images (named after their quoted URL path). Returns the number of files
+    removed."""
+    removed = 0
+    for pattern in ("*.png", "%2F*"):
+        for legacy in Path(cache_dir).glob(pattern):
+            if legacy.is_file():
+                legacy.unlink()
+                removed += 1
+    return removed
+
+
+def file_digest(file_path: str | Path) -> str:
+    """Get a hash of a file's content. The result is memoized for the life of the
+    process (unless the file has since been modified)."""
+    stat = Path(file_path).stat()
+    key = (str(file_path), stat.st_mtime_ns, stat.st_size)
+    if key not in _FILE_DIGESTS:
+        _FILE_DIGESTS[key] = hashlib.sha256(Path(file_path).read_bytes()).hexdigest()
+    return _FILE_DIGESTS[key]
+
+
+def atomic_write(file_path: Path, data: bytes):
+    """Write ``data`` to a temporary file that then replaces the given ``file_path``.
+
+    This way, concurrent readers (and writers) never see a partially written file.
+    """
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_name, file_path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+
+def install_card(src: Path, dest: Path) -> bool:
+    """Copy a cached card image to the build output (atomically).
+
+    The card's hash is in its file name, so an existing ``dest`` file of the same size
+    is assumed to be the same image and is not written again. Returns :python:`True` if
+    the ``dest`` file was written.
+    """
+    try:
+        if dest.stat().st_size == src.stat().st_size:
+            return False
+    except FileNotFoundError:
+        pass
+    atomic_write(dest, src.read_bytes())
+    return True
+
+
+class RenderCache:
+    """A content-addressed store of rendered cards.
+
+    Each entry is an image file and a JSON file (which holds the hash used to name the
+    card in the build output) that are both named after the entry's key.
+    """
+
+    def __init__(self, cache_dir: str | Path):
+        self.root = cache_path(cache_dir, "renders")
+
+    def get(self, key: str, suffix: str = ".png") -> tuple[Path, str] | None:
+        """Get the cached image's path and hash for the given ``key`` (if any)."""
+        img_path = Path(self.root, key).with_suffix(suffix)
+        info_path = img_path.with_suffix(".json")
+        if not img_path.exists() or not info_path.exists():
+            return None
+        info = json.loads(info_path.read_text(encoding="utf-8"))
+        touch(img_path)
+        return img_path, info["hash"]
+
+    def put(self, key: str, data: bytes, img_hash: str, suffix: str = ".png") -> Path:
+        """Store an encoded card image (and its hash) using the given ``key``."""
+        img_path = Path(self.root, key).with_suffix(suffix)
+        atomic_write(img_path, data)
+        # the info file is written last, so an interrupted write does not count as a hit
+        atomic_write(img_path.with_suffix(".json"), json.dumps({"hash": img_hash}).encode())
+        return img_path
+
+
+class LRUCache(Generic[_K, _V]):
+    """An in-memory mapping whose least recently used items are discarded by `evict()`.
+
+    The ``weigh`` function gets the weight of an item's value (eg. its size in bytes). By
+    default, each item weighs 1.
+    """
+
+    def __init__(self, weigh: Callable[[_V], int] = lambda _: 1):
+        self._items: OrderedDict[_K, _V] = OrderedDict()
+        self._weigh = weigh
+        #: The total weight of all items.
+        self.weight = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._items
+
+    def get(self, key: _K) -> _V | None:
+        """Get the value of an item (if any) and mark the item as the most recently used."""
+        if key not in self._items:
+            return None
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key: _K, value: _V):
+        """Add (or replace) an item as the most recently used."""
+        self.pop(key)
+        self._items[key] = value
+        self.weight += self._weigh(value)
+
+    def pop(self, key: _K) -> _V | None:
+        """Remove an item (if any) and get its value."""
+        if key not in self._items:
+            return None
+        value = self._items.pop(key)
+        self.weight -= self._weigh(value)
+        return value
+
+    def evict(self, max_entries: int | None = None, max_weight: int | None = None) -> list[_V]:
+        """Discard the least recently used items until there are no more than
+        ``max_entries`` items and their total weight is no more than ``max_weight``
+        (:python:`None` means no limit). Returns the values of the discarded items.
+
+        The most recently used item is not discarded for exceeding the ``max_weight``.
+        """
+        evicted: list[_V] = []
+        while self._items and (
+            (max_entries is not None and len(self._items) > max_entries)
+            or (max_weight is not None and self.weight > max_weight and len(self._items) > 1)
+        ):
+            _, value = self._items.popitem(last=False)
+            self.weight -= self._weigh(value)
+            evicted.append(value)
+        return evicted
+
+    def clear(self) -> list[_V]:
+        """Discard all items. Returns the values of the discarded items."""
+        values = list(self._items.values())
+        self._items.clear()
+        self.weight = 0
+        return values
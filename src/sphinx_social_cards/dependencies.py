@@ -0,0 +1,181 @@
+"""Tracking the inputs that a card actually depends on.
+
+While a layout is rendered (by jinja), the context paths that the layout accesses (eg.
+``page.title`` or ``layout.background_color``) are recorded with a `TrackedDict`. A card
+is then identified by a digest of each accessed context value, and a digest of the
+inputs that are not part of the context (the extension's options, the layout files, and
+the font and image files used). If none of these digests change, then the card does not
+need to be rendered again.
+"""
+
+from functools import lru_cache
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Iterable
+
+from .cache import CACHE_VERSION, file_digest
+from .validators import Social_Cards
+
+#: A path to an item in the jinja contexts, eg. :python:`("page", "title")`.
+ContextPath = tuple[str, ...]
+# the first item of the context paths that do not depend on the document
+BUILD_CONTEXTS = ("config", "layout", "plugin")
+
+
+class TrackedDict(dict):
+    """A `dict` that records which of its items are accessed.
+
+    Nested `dict` items are also tracked (as they are accessed). Any other item is
+    recorded by its path. If the `dict` is used as a whole (eg. iterated or serialized),
+    then the path of the `dict` itself is recorded.
+    """
+
+    __slots__ = ("_path", "_accessed")
+
+    def __init__(self, src: dict, path: ContextPath, accessed: set[ContextPath]):
+        super().__init__(src)
+        self._path = path
+        self._accessed = accessed
+
+    @classmethod
+    def track(cls, context: dict[str, Any], accessed: set[ContextPath]) -> dict[str, Any]:
+        """Wrap each `dict` in a (jinja) ``context``, so the accessed paths are added to
+        the given ``accessed`` set."""
+        return {
+            key: cls(val, (key,), accessed) if isinstance(val, dict) else val
+            for key, val in context.items()
+        }
+
+    @staticmethod
+    def untrack(value: Any) -> Any:
+        """Replace any `TrackedDict` in the ``value`` with a regular `dict` for use with
+        functions that do not accept `dict` subclasses."""
+        if isinstance(value, TrackedDict):
+            value._accessed.add(value._path)
+            return dict(dict.items(value))  # the items' values are not tracked
+        if isinstance(value, dict):
+            return {key: TrackedDict.untrack(val) for key, val in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(TrackedDict.untrack(val) for val in value)
+        return value
+
+    def _used_whole(self):
+        self._accessed.add(self._path)
+
+    def __getitem__(self, key: str) -> Any:
+        path = self._path + (str(key),)
+        try:
+            value = super().__getitem__(key)
+        except KeyError:
+            self._accessed.add(path)  # the item's absence is also an input
+            raise
+        if isinstance(value, dict):
+            return TrackedDict(value, path, self._accessed)
+        self._accessed.add(path)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: object) -> bool:
+        self._accessed.add(self._path + (str(key),))
+        return super().__contains__(key)
+
+    def __iter__(self):
+        self._used_whole()
+        return super().__iter__()
+
+    def __len__(self) -> int:
+        self._used_whole()
+        return super().__len__()
+
+    def __eq__(self, other: object) -> bool:
+        self._used_whole()
+        return super().__eq__(other)
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        self._used_whole()
+        return super().__repr__()
+
+    def keys(self):
+        self._used_whole()
+        return super().keys()
+
+    def values(self):
+        self._used_whole()
+        return super().values()
+
+    def items(self):
+        self._used_whole()
+        return super().items()
+
+    def copy(self) -> dict:
+        return TrackedDict.untrack(self)
+
+
+def _lookup(context: dict[str, Any], path: ContextPath) -> tuple[bool, Any]:
+    value: Any = context
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return False, None
+        value = value[key]
+    return True, value
+
+
+def context_digests(
+    context: dict[str, Any], paths: Iterable[ContextPath]
+) -> dict[ContextPath, str]:
+    """Get a digest of the value at each of the given ``paths`` in the ``context``. The
+    digest of a missing item is an empty string."""
+    digests: dict[ContextPath, str] = {}
+    for path in paths:
+        found, value = _lookup(context, path)
+        if not found:
+            digests[path] = ""
+            continue
+        src = json.dumps(value, sort_keys=True, default=str)
+        digests[path] = hashlib.sha256(src.encode("utf-8")).hexdigest()[:16]
+    return digests
+
+
+@lru_cache(maxsize=32)
+def layouts_digest(search_path: tuple[str, ...]) -> str:
+    """Get a digest of all the layout files in the given ``search_path``. The result is
+    memoized until `layouts_digest.cache_clear() <functools.lru_cache>` is called (at
+    the start of each build)."""
+    digests = []
+    for layout_dir in search_path:
+        for file_path in sorted(Path(layout_dir).rglob("*")):
+            if file_path.is_file():
+                digests.append(
+                    (file_path.relative_to(layout_dir).as_posix(), file_digest(file_path))
+                )
+    return hashlib.sha256(json.dumps(digests).encode("utf-8")).hexdigest()
+
+
+def inputs_digest(config: Social_Cards, search_path: tuple[str, ...], resources: list[str]) -> str:
+    """Get a digest of a card's inputs that are not part of the jinja contexts.
+
+    The ``config``'s default font must already be resolved (see
+    `FontSourceManager.resolve() <fonts.FontSourceManager.resolve>`).
+    """
+    options = config.model_dump(mode="json", exclude={"cards_layout_options"})
+    layout_options = config.cards_layout_options
+    assert layout_options.font is not None
+    src = {
+        "version": CACHE_VERSION,
+        "options": options,
+        # the layout options that are used without being accessed by the layout
+        "font": layout_options.font.model_dump(mode="json", exclude={"path"}),
+        "color": str(layout_options.color),
+        "layouts": layouts_digest(search_path),
+        "resources": [file_digest(res) if Path(res).exists() else "" for res in resources],
+    }
+    canonical = json.dumps(src, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
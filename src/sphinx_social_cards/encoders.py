@@ -0,0 +1,96 @@
+"""Encoders that save the generated images in various file formats.
+
+The encoder is chosen by the `output_format <Social_Cards.output_format>` option. More
+encoders can be added to the `ENCODERS` registry using `register_encoder()`.
+"""
+
+from functools import lru_cache
+from typing import Callable, NamedTuple, cast
+
+from PySide6.QtCore import QBuffer, QIODevice
+from PySide6.QtGui import QImage, QImageWriter
+
+
+class ImageEncoder(NamedTuple):
+    """A description of how images are saved in a certain file format."""
+
+    #: The file extension (including the leading period) of the saved images.
+    suffix: str
+    #: The MIME type of the saved images (used in the ``og:image:type`` metadata).
+    mime_type: str
+    #: The name of the format that Qt uses to write the images.
+    qt_format: str
+    #: A function that converts the image before it is written (if needed).
+    convert: Callable[[QImage], QImage] | None = None
+
+
+def _is_opaque(img: QImage) -> bool:
+    alpha = img.convertToFormat(QImage.Format.Format_Alpha8)
+    data = bytes(alpha.constBits())
+    line_len = alpha.bytesPerLine()
+    width = alpha.width()
+    return not any(
+        data[y * line_len : y * line_len + width].strip(b"\xff") for y in range(alpha.height())
+    )
+
+
+def quantize(img: QImage) -> QImage:
+    """Convert an image to use an 8-bit color palette.
+
+    Qt only creates a palette of the exact colors (if there are 256 colors or less) for
+    opaque images. It also cannot preserve semi-transparent pixels in a palette. So, an
+    image with transparent pixels is returned unchanged.
+    """
+    if not _is_opaque(img):
+        return img
+    opaque = img.convertToFormat(QImage.Format.Format_RGB32)
+    return opaque.convertToFormat(QImage.Format.Format_Indexed8)
+
+
+#: The encoders (mapped by the names used in `Output_Format.format`).
+ENCODERS: dict[str, ImageEncoder] = {
+    "png": ImageEncoder(".png", "image/png", "PNG"),
+    "png8": ImageEncoder(".png", "image/png", "PNG", quantize),
+    "webp": ImageEncoder(".webp", "image/webp", "WEBP"),
+    "avif": ImageEncoder(".avif", "image/avif", "AVIF"),
+}
+
+
+def register_encoder(name: str, encoder: ImageEncoder):
+    """Add an encoder to the `ENCODERS` registry (or replace an existing one)."""
+    ENCODERS[name.lower()] = encoder
+
+
+@lru_cache(maxsize=1)
+def _supported_formats() -> list[str]:
+    return [bytes(fmt.data()).decode() for fmt in QImageWriter.supportedImageFormats()]
+
+
+def get_encoder(name: str) -> ImageEncoder:
+    """Get a registered encoder that Qt is able to write."""
+    encoder = ENCODERS[name]
+    supported = _supported_formats()
+    if encoder.qt_format.lower() not in supported:
+        raise RuntimeError(
+            f"The {name} output format requires a Qt image plugin for {encoder.qt_format}, "
+            f"but only {supported} are supported"
+        )
+    return encoder
+
+
+def encode_image(img: QImage, fmt: str = "PNG", quality: int = -1) -> bytes:
+    """Encode an image into the bytes of the given file format."""
+    buffer = QBuffer()
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    # the stubs expect bytes, but PySide6 only accepts a str at runtime
+    if not img.save(buffer, cast(bytes, fmt), quality):
+        raise RuntimeError(f"Failed to encode image as {fmt}")
+    return bytes(buffer.data().data())
+
+
+def encode_card(img: QImage, name: str, quality: int = -1) -> bytes:
+    """Encode an image using the encoder registered with the given ``name``."""
+    encoder = get_encoder(name)
+    if encoder.convert is not None:
+        img = encoder.convert(img)
+    return encode_image(img, encoder.qt_format, quality)
@@ -0,0 +1,210 @@
+"""A shared layer for fetching remote resources (images, fonts, and API data).
+
+All requests use a pooled `requests.Session`, so connections to the same host are
+reused. Failed requests (and responses with a transient error status) are retried with
+an exponential backoff. Downloaded files are revalidated against the server (using the
+``ETag`` and ``Last-Modified`` headers) once they are older than
+`Fetcher.revalidate_after`.
+
+Responses can also be recorded to (or read from) a `ResourceBundle <bundle.ResourceBundle>`
+depending on the `Fetcher.mode`. In ``offline`` mode, the network is never used.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+from pathlib import Path
+import threading
+import time
+from typing import Any, Iterable, Literal
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from sphinx.util.logging import getLogger
+from urllib3.util.retry import Retry
+
+from .bundle import ResourceBundle
+from .cache import atomic_write, touch
+
+LOGGER = getLogger(__name__)
+#: The (connect, read) timeout (in seconds) used for each request.
+REQUEST_TIMEOUT = (5, 10)
+
+
+class _BoundedRetry(Retry):
+    """A `Retry` that never waits longer than `Fetcher.max_retry_after` (neither for its
+    backoff nor for a response's ``Retry-After`` header)."""
+
+    def get_backoff_time(self) -> float:
+        return min(super().get_backoff_time(), Fetcher.max_retry_after)
+
+    def get_retry_after(self, response) -> float | None:
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, Fetcher.max_retry_after)
+
+
+class Fetcher:
+    """A process-wide pool of HTTP connections."""
+
+    #: The maximum number of concurrent requests (and pooled connections per host).
+    max_workers: int = 8
+    #: The number of times a failed request is retried.
+    retries: int = 3
+    #: The factor (in seconds) of the exponential delay between retries.
+    backoff: float = 0.5
+    #: The longest delay (in seconds) between retries, including the delay requested by
+    #: a response's ``Retry-After`` header.
+    max_retry_after: float = 60
+    #: The age (in seconds) after which a downloaded file is revalidated.
+    revalidate_after: float = 24 * 60 * 60
+    #: How the `bundle` is used:
+    #:
+    #: - ``online``: The bundle is not used.
+    #: - ``record``: Every requested resource is saved in the bundle. Downloaded files
+    #:   are saved as they are on disk. Other resources cached on disk (REST API
+    #:   responses and fonts) are requested again.
+    #: - ``offline``: Responses are only read from the bundle. A `RuntimeError` is
+    #:   raised if a requested resource is not in the bundle.
+    mode: Literal["online", "record", "offline"] = "online"
+    #: The bundle used in ``record`` and ``offline`` `mode`.
+    bundle: ResourceBundle | None = None
+    _session: requests.Session | None = None
+    _lock = threading.Lock()
+    # the URLs saved in the bundle while recording
+    _recorded: set[str] = set()
+
+    @classmethod
+    def use_cache(cls) -> bool:
+        """Can a resource cached on disk be used without requesting it?"""
+        return cls.mode != "record"
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        """Get the shared session (which is created on first use)."""
+        with cls._lock:
+            if cls._session is None:
+                retry = _BoundedRetry(
+                    total=cls.retries,
+                    backoff_factor=cls.backoff,
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=("GET", "HEAD"),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_maxsize=cls.max_workers, max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                cls._session = session
+            return cls._session
+
+    @classmethod
+    def request(cls, url: str, timeout=REQUEST_TIMEOUT, **kwargs: Any) -> requests.Response:
+        """Send a GET request (using the `bundle` according to the `mode`)."""
+        if cls.mode == "offline" or (cls.mode == "record" and url in cls._recorded):
+            entry = None if cls.bundle is None else cls.bundle.get(url)
+            if entry is None:
+                raise RuntimeError(
+                    f"{url} is not in the offline resource bundle; run "
+                    "`python -m sphinx_social_cards.bundle <sourcedir>` to create it"
+                )
+            response = requests.Response()
+            response.status_code = 200
+            response.url = url
+            response.headers = CaseInsensitiveDict(entry[1])
+            response._content = entry[0]
+            return response
+        if cls.mode == "record":
+            # request the full response (not just a confirmation that the cache is valid)
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers.pop("If-None-Match", None)
+            headers.pop("If-Modified-Since", None)
+            kwargs["headers"] = headers
+        response = cls.session().get(url, timeout=timeout, **kwargs)
+        if cls.mode == "record" and cls.bundle is not None and response.status_code == 200:
+            cls.bundle.put(url, response.content, response.headers)
+            cls._recorded.add(url)  # each resource is only requested once
+        return response
+
+    @classmethod
+    def get(cls, url: str, timeout=REQUEST_TIMEOUT, **kwargs: Any) -> requests.Response:
+        """Send a GET request. Raises a `RuntimeError` if the response is not OK."""
+        response = cls.request(url, timeout=timeout, **kwargs)
+        if response.status_code != 200:
+            raise RuntimeError(f"requested {url} returned {response.status_code}")
+        return response
+
+    @classmethod
+    def download(cls, url: str, file_path: Path) -> Path:
+        """Download the file at ``url`` to the given ``file_path`` (if not already
+        downloaded).
+
+        The response's validators (``ETag`` and ``Last-Modified`` headers) are saved in
+        a JSON file alongside the downloaded file. If the downloaded file is older than
+        `revalidate_after`, then the validators are used to check if the file changed.
+        When the server cannot be reached, the downloaded file is used as is.
+        """
+        info_path = file_path.with_name(f"{file_path.name}.json")
+        if file_path.exists():
+            if cls.mode == "record" and cls.bundle is not None:
+                # the file may have been processed (eg. downsampled) after it was downloaded
+                if url not in cls._recorded:
+                    cls.bundle.put(url, file_path.read_bytes(), {})
+                    cls._recorded.add(url)
+                return file_path
+            if cls.mode == "offline":
+                return file_path
+            if time.time() - file_path.stat().st_mtime < cls.revalidate_after:
+                return file_path
+            headers = {}
+            if info_path.exists():
+                info = json.loads(info_path.read_text(encoding="utf-8"))
+                if info.get("etag"):
+                    headers["If-None-Match"] = info["etag"]
+                if info.get("last_modified"):
+                    headers["If-Modified-Since"] = info["last_modified"]
+            try:
+                response = cls.request(url, headers=headers)
+            except requests.RequestException as exc:
+                LOGGER.debug("failed to revalidate %s: %s", url, exc)
+                return file_path
+            if response.status_code == 304:
+                touch(file_path)
+                return file_path
+            if response.status_code != 200:
+                LOGGER.debug("failed to revalidate %s: %d", url, response.status_code)
+                return file_path
+        else:
+            response = cls.get(url)
+        atomic_write(file_path, response.content)
+        info = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        atomic_write(info_path, json.dumps(info).encode())
+        return file_path
+
+    @classmethod
+    def prefetch(cls, downloads: Iterable[tuple[str, Path]]):
+        """Download several files concurrently (see `download()`).
+
+        Each item is a ``(url, file_path)`` pair. Errors are not raised here; a failed
+        download is attempted again (and raises its error) when the file is needed.
+        """
+        pending = {url: file_path for url, file_path in downloads}
+        if not pending:
+            return
+
+        def fetch(item: tuple[str, Path]):
+            try:
+                cls.download(*item)
+            except Exception as exc:
+                LOGGER.debug("failed to prefetch %s: %s", item[0], exc)
+
+        if len(pending) == 1:
+            fetch(next(iter(pending.items())))
+            return
+        with ThreadPoolExecutor(max_workers=min(cls.max_workers, len(pending))) as pool:
+            list(pool.map(fetch, pending.items()))
@@ -5,20 +5,31 @@ from urllib.parse import quote
 from pathlib import Path
 from typing import Any, NamedTuple
 
-from PySide6.QtGui import QGuiApplication
+from PySide6.QtGui import QGuiApplication, QFontDatabase, QRawFont
 from sphinx.util.logging import getLogger
+from .cache import LRUCache, atomic_write, cache_path
+from .fetch import Fetcher
 from .validators import try_request
 from .validators.layers import Font
 
 _FONT_SOURCE_API = "https://api.fontsource.org/"
 LOGGER = getLogger(__name__)
 
-# to use fonts, we must instantiate a QGuiApplication obj to initialize the
-# font-hinting fallbacks.
-# NOTE: this package comes with its own cache of fonts, but they are not
-# expected to be installed on the system.
-if not QGuiApplication.instance():
-    Q_APP = QGuiApplication()
+_Q_APP: QGuiApplication | None = None
+
+
+def ensure_qt_app():
+    """Instantiate a QGuiApplication (if one does not already exist) for this process.
+
+    To use fonts, we must instantiate a QGuiApplication obj to initialize the
+    font-hinting fallbacks. This is not done on import, so that processes can be
+    started (or forked) before any Qt state exists.
+    """
+    # NOTE: this package comes with its own cache of fonts, but they are not
+    # expected to be installed on the system.
+    global _Q_APP
+    if not QGuiApplication.instance():
+        _Q_APP = QGuiApplication()
 
 
 class QtAppFontInfo(NamedTuple):
@@ -29,32 +40,134 @@ class QtAppFontInfo(NamedTuple):
     style: str
 
 
+class FontRegistry:
+    """A process-wide registry of fonts loaded into the QFontDatabase.
+
+    Each font file is only loaded once (regardless of how many cards or layers use it).
+    If `max_bytes` is set, then the least recently used fonts are unloaded when the
+    total size of the loaded font files exceeds `max_bytes`.
+    """
+
+    #: The maximum total size (in bytes) of loaded font files. :python:`None` means no limit.
+    max_bytes: int | None = None
+    # the info and size (in bytes) of each loaded font file
+    _fonts: LRUCache[str, tuple[QtAppFontInfo, int]] = LRUCache(weigh=lambda font: font[1])
+
+    @classmethod
+    def get(cls, font_path: str) -> QtAppFontInfo:
+        """Get the info about a font file, loading it into the QFontDatabase if needed."""
+        cached = cls._fonts.get(font_path)
+        if cached is not None:
+            return cached[0]
+        app_font_id = QFontDatabase.addApplicationFont(font_path)
+        if app_font_id < 0:
+            raise RuntimeError(f"Failed to load font: {font_path}")
+        family = QFontDatabase.applicationFontFamilies(app_font_id)[0]
+        # A family's styles (in the QFontDatabase) accumulate as more of the family's
+        # fonts are loaded. So, use the style name from the font file itself.
+        style = QRawFont(font_path, 12).styleName()
+        styles = QFontDatabase.styles(family)
+        if style not in styles:
+            style = styles[0]
+        info = QtAppFontInfo(id=app_font_id, family=family, style=style)
+        size = Path(font_path).stat().st_size
+        cls._fonts.put(font_path, (info, size))
+        for evicted, _ in cls._fonts.evict(max_weight=cls.max_bytes):
+            QFontDatabase.removeApplicationFont(evicted.id)
+        return info
+
+    @classmethod
+    def clear(cls):
+        """Unload all fonts from the QFontDatabase."""
+        for info, _ in cls._fonts.clear():
+            QFontDatabase.removeApplicationFont(info.id)
+
+
+def _font_metadata(info: dict[str, Any]) -> dict[str, Any]:
+    """Get the info needed to resolve a font (without the URLs of each variant)."""
+    keys = ("id", "family", "styles", "subsets", "defSubset", "weights")
+    return {key: info[key] for key in keys if key in info}
+
+
 class FontSourceManager:
     api_version = "v1/fonts"
     cache_path = Path.cwd()
     dist_cache = Path(__file__).parent / ".fonts"
+    #: The name of the file (in a font cache folder) that indexes the cached families.
+    index_name = "index.json"
+    # the metadata of the cached families (mapped by cache folder and then family)
+    _index: dict[Path, dict[str, dict[str, Any]]] = {}
+    # (folder, family, style, subset, weight) -> (resolved subset, resolved weight, ttf path)
+    _resolved: dict[tuple[Path, str, str, str | None, int], tuple[str, int, str]] = {}
 
     @classmethod
     def get_font_file_name(cls, font: Font) -> str:
         return f"{font.family} {font.style} ({font.subset} {font.weight})"
 
+    @classmethod
+    def _get_folder(cls, font: Font) -> Path:
+        if font.family.startswith("Roboto"):
+            return cls.dist_cache
+        return Path(cls.cache_path)
+
+    @classmethod
+    def resolve(cls, font: Font, cache_dir: str | Path):
+        """Resolve the given ``font``'s specs and path using the ``cache_dir``."""
+        cls.cache_path = cache_path(cache_dir, "fonts")
+        cls.get_font(font)
+
     @classmethod
     def get_font(cls, font: Font):
+        folder = cls._get_folder(font)
+        use_cache = Fetcher.use_cache() or folder == cls.dist_cache
+        key = (folder, font.family, font.style, font.subset, font.weight)
+        if use_cache and key in cls._resolved:
+            font.subset, font.weight, font.path = cls._resolved[key]
+            return
         info_cache = cls._get_info(font)  # fills in unset `Font` specs
         font_file_name = cls.get_font_file_name(font)
         ttf_cache = Path(info_cache.parent, font_file_name).with_suffix(".ttf")
-        if ttf_cache.exists():
+        if ttf_cache.exists() and use_cache:
             font.path = str(ttf_cache)
-            return
-        cls._download(font, info_cache)
+        else:
+            cls._download(font, info_cache)
+        assert font.subset is not None and font.path is not None
+        cls._resolved[key] = (font.subset, font.weight, font.path)
+
+    @classmethod
+    def _get_index(cls, folder: Path) -> dict[str, dict[str, Any]]:
+        """Get the metadata of the families cached in the given folder.
+
+        The index is loaded once per process. Any family's info that is cached but not
+        yet indexed (eg. from an older version of this extension) is added to it.
+        """
+        if folder in cls._index:
+            return cls._index[folder]
+        index_path = Path(folder, cls.index_name)
+        index: dict[str, dict[str, Any]] = {}
+        if index_path.exists():
+            try:
+                index = json.loads(index_path.read_text(encoding="utf-8"))
+            except ValueError:
+                index = {}
+        indexed = len(index)
+        for info_path in folder.glob("*.json"):
+            if info_path.name == cls.index_name or info_path.stem in index:
+                continue
+            info = json.loads(info_path.read_text(encoding="utf-8"))
+            index[info.get("family", info_path.stem)] = _font_metadata(info)
+        if len(index) != indexed and folder != cls.dist_cache:
+            atomic_write(index_path, json.dumps(index).encode())
+        cls._index[folder] = index
+        return index
 
     @classmethod
     def _get_info(cls, font: Font) -> Path:
-        info_cache = Path(cls.cache_path, font.family).with_suffix(".json")
-        if font.family.startswith("Roboto"):
-            info_cache = Path(cls.dist_cache, font.family).with_suffix(".json")
-        if info_cache.exists():
-            font_info = json.loads(info_cache.read_text(encoding="utf-8"))
+        folder = cls._get_folder(font)
+        info_cache = Path(folder, font.family).with_suffix(".json")
+        index = cls._get_index(folder)
+        if font.family in index and (Fetcher.use_cache() or folder == cls.dist_cache):
+            font_info = index[font.family]
         else:
             url = f"{_FONT_SOURCE_API}{cls.api_version}?family={quote(font.family)}"
             response = try_request(url)
@@ -71,6 +184,8 @@ class FontSourceManager:
             font_info = info[0]
             info_cache.parent.mkdir(parents=True, exist_ok=True)
             info_cache.write_text(json.dumps(font_info, indent=2), encoding="utf-8")
+            index[font.family] = _font_metadata(font_info)
+            atomic_write(Path(folder, cls.index_name), json.dumps(index).encode())
         styles = font_info.get("styles", [])
         if font.style not in styles:
             raise ValueError(f"{font.family} font family has no {font.style} style; only: {styles}")
@@ -91,10 +206,10 @@ class FontSourceManager:
             diffs = [abs(w - font.weight) for w in weights]
             closest = diffs[0]
             weight = weights[0]
-            for index, diff in enumerate(diffs):
+            for i, diff in enumerate(diffs):
                 if diff < closest:
                     closest = diff
-                    weight = weights[index]
+                    weight = weights[i]
             font.weight = weight
         return info_cache
 
@@ -104,7 +219,9 @@ class FontSourceManager:
         info: dict[str, Any] = json.loads(info_cache.read_text(encoding="utf-8"))
         font_id = info.get("id", None)
         assert font_id is not None
-        if "variants" not in info:
+        if "variants" not in info or not (
+            Fetcher.use_cache() or info_cache.parent == cls.dist_cache
+        ):
             response = try_request(f"{_FONT_SOURCE_API}{cls.api_version}/{font_id}")
             info = response.json()
             info_cache.write_text(json.dumps(info, indent=2), encoding="utf-8")
@@ -1,7 +1,12 @@
+from contextlib import contextmanager
+import hashlib
+import json
 import math
 from logging import getLogger
 import re
+from functools import lru_cache
 from pathlib import Path
+from typing import Any, Iterator, cast
 
 from jinja2 import TemplateNotFound, FileSystemLoader, Template
 from jinja2.sandbox import SandboxedEnvironment
@@ -25,7 +30,7 @@ from PySide6.QtGui import (
 )
 import yaml
 
-from .validators import Social_Cards
+from .validators import Social_Cards, Debug, Output_Format
 from .validators.layers import (
     Typography,
     LayerImage,
@@ -35,16 +40,22 @@ from .validators.layers import (
     Polygon,
     ColorType,
 )
-from .validators.common import Gradient
+from .validators.common import Gradient, serialize_color
 from .validators.layout import Layer, Layout, Offset
 from .validators.contexts import JinjaContexts
-from .fonts import FontSourceManager, QtAppFontInfo
+from .fonts import FontSourceManager, FontRegistry, QtAppFontInfo, ensure_qt_app
 from .colors import ColorAttr, auto_get_fg_color, get_qt_color, get_qt_gradient
-from .images import find_image, resize_image, overlay_color
+from .images import ImageCache, find_image, overlay_color
+from .atlas import LayerAtlas
+from .cache import CACHE_VERSION, LRUCache, download_path, file_digest
+from .fetch import Fetcher
+from .dependencies import ContextPath, TrackedDict, context_digests, inputs_digest
 
 LOGGER = getLogger(__name__)
 _DEFAULT_LAYOUT_DIR = Path(__file__).parent / "layouts"
 layout_validator: TypeAdapter[Layout] = TypeAdapter(Layout)
+# use the C-backed YAML parser (if pyyaml was built with libyaml)
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 
 def _insert_wbr(text: str, token: str = " ") -> str:
@@ -59,63 +70,260 @@ def _insert_wbr(text: str, token: str = " ") -> str:
     return text
 
 
+def _tokenize(text: str) -> list[str]:
+    """Split text into the words, whitespace and newlines used for line breaking."""
+    return [t for t in re.split(r"([\0\s\n])", _insert_wbr(text, "\0")) if t not in ("", "\0")]
+
+
+def _break_lines(
+    tokens: list[str],
+    widths: dict[str, tuple[float, float]],
+    line_amt: int,
+    max_width: float,
+    overflow: bool,
+) -> tuple[list[str], str | None] | None:
+    """Break ``tokens`` into (no more than ``line_amt``) lines using each token's
+    ``widths`` (its advance and the extent of its glyphs' ink).
+
+    Returns :python:`None` if ``overflow`` is enabled and the tokens need more lines.
+    Otherwise, returns the lines and the token that did not fit on the last line (if
+    the text had to be truncated).
+    """
+    lines: list[str] = [""]
+    line_width = 0.0
+    for word in tokens:
+        if word == " " and not lines[-1]:
+            continue
+        if word == "\n":
+            if len(lines) < line_amt:
+                lines.append("")
+                line_width = 0.0
+                continue
+            if overflow:
+                return None
+            word = " "  # just discard the token if we can't add another line
+        advance, extent = widths[word]
+        # trailing whitespace does not count toward the width of a line
+        if word.isspace() or line_width + extent < max_width:  # text fits!
+            lines[-1] += word
+            line_width += advance
+        # text does not fit!
+        elif len(lines) < line_amt:  # line capacity filled and more lines available
+            lines[-1] = lines[-1].strip()
+            lines.append(word)
+            line_width = advance
+        elif overflow:  # no lines left but overflow is allowed
+            return None
+        else:  # text has overflow but typography.overflow is disabled
+            return lines, word
+    return lines, None
+
+
+@lru_cache(maxsize=None)
+def _font_height(family: str, style: str, size: int) -> float:
+    return QFontMetricsF(QFontDatabase.font(family, style, size)).height()
+
+
+@lru_cache(maxsize=None)
+def _solve_font_size(
+    family: str, style: str, line_amt: int, line_height: float | int, max_height: float | int
+) -> int:
+    """Get the point size of a font that best fits the given line constraints.
+
+    Font sizes are even numbers. The result is the largest size (not bigger than the
+    theoretical size) whose height fits the available line height, or the next bigger
+    size if that is still more than 1 pixel shorter than the available line height.
+    Font heights only grow with the size, so both sizes are found using a binary search.
+    """
+    theoretical_height = max_height / line_amt
+    space = theoretical_height - (theoretical_height * line_height)
+    space = space * max(1, line_amt - 1) / line_amt
+    target = theoretical_height - space
+    start = target - target % 2
+
+    def height(size: float) -> float:
+        return _font_height(family, style, int(max(1, size)))
+
+    # shrink the font (in steps of 2) until it fits or reaches the minimum size
+    lo, hi = 0, max(0, math.ceil((start - 2) / 2))
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if height(start - 2 * mid) <= target:
+            hi = mid
+        else:
+            lo = mid + 1
+    size = start - 2 * lo
+
+    # grow the font (in steps of 2) until it is no more than 1 pixel too short
+    if height(size) < target - 1:
+        steps = 1
+        while height(size + 2 * steps) < target - 1:
+            steps *= 2
+        lo, hi = steps // 2 + 1, steps
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if height(size + 2 * mid) >= target - 1:
+                hi = mid
+            else:
+                lo = mid + 1
+        size += 2 * lo
+    return int(max(1, size))
+
+
+@lru_cache(maxsize=None)
+def _get_jinja_env(search_path: tuple[str, ...]) -> SandboxedEnvironment:
+    """Get the jinja environment that loads layouts from the given ``search_path``.
+
+    Environments are shared by all cards that use the same layout directories, so the
+    templates compiled (and cached) by an environment are reused for every document.
+    """
+    jinja_env = SandboxedEnvironment(loader=FileSystemLoader(list(search_path)))
+    jinja_env.block_start_string = "#%"
+    jinja_env.block_end_string = "%#"
+    jinja_env.variable_start_string = "'{{"
+    jinja_env.variable_end_string = "}}'"
+    jinja_env.comment_start_string = "##"
+    jinja_env.comment_end_string = "##"
+    # jinja_env.line_statement_prefix = "#%"
+    jinja_env.line_comment_prefix = "##"
+    jinja_env.finalize = lambda output: "null" if output is None else output
+    jinja_env.filters["yaml"] = lambda x: (
+        yaml.safe_dump(TrackedDict.untrack(x), default_flow_style=True)
+        .rstrip("\n...\n")
+        .rstrip("\n")
+    )
+    return jinja_env
+
+
+@lru_cache(maxsize=256)
+def _compile_template(search_path: tuple[str, ...], content: str) -> Template:
+    return _get_jinja_env(search_path).from_string(content)
+
+
+# maps a (search_path, layout) pair to the layout's file name (with its extension)
+_LAYOUT_FILES: dict[tuple[tuple[str, ...], str], str] = {}
+
+
+def _get_layout_template(search_path: tuple[str, ...], layout: str) -> Template:
+    """Get the compiled template for a layout (specified without its file extension).
+
+    The found file name is remembered, so the supported extensions are only probed the
+    first time a layout is used.
+    """
+    jinja_env = _get_jinja_env(search_path)
+    key = (search_path, layout)
+    if key in _LAYOUT_FILES:
+        try:
+            return jinja_env.get_template(_LAYOUT_FILES[key])
+        except TemplateNotFound:  # the file was removed, so look for it again
+            del _LAYOUT_FILES[key]
+    for ext in (".yml", ".yaml", ".YML", ".YAML"):
+        try:
+            template = jinja_env.get_template(layout + ext)
+        except TemplateNotFound:
+            continue  # we'll raise the error when all extensions were tried
+        _LAYOUT_FILES[key] = layout + ext
+        return template
+    raise ValueError(f"Could not find layout: '{layout}'")
+
+
+class _CanvasPool:
+    """Reusable off-screen canvases (used to render layers that have a mask)."""
+
+    #: The maximum number of unused canvases kept (for each canvas size).
+    max_free = 2
+    #: The maximum number of canvas sizes kept.
+    max_sizes = 8
+    _free: LRUCache[tuple[int, int], list[QImage]] = LRUCache()
+
+    @classmethod
+    @contextmanager
+    def borrow(cls, width: int, height: int) -> Iterator[QImage]:
+        """Borrow a transparent canvas of the given size."""
+        key = (width, height)
+        free = cls._free.get(key)
+        if free is None:
+            free = []
+            cls._free.put(key, free)
+            cls._free.evict(cls.max_sizes)
+        if free:
+            canvas = free.pop()
+        else:
+            canvas = QImage(width, height, QImage.Format.Format_ARGB32_Premultiplied)
+        canvas.fill(Qt.GlobalColor.transparent)
+        try:
+            yield canvas
+        finally:
+            if len(free) < cls.max_free:
+                free.append(canvas)
+
+
+@lru_cache(maxsize=128)
+def _validate_layout(layout_yaml: str) -> Layout:
+    return layout_validator.validate_python(yaml.load(layout_yaml, Loader=_YAML_LOADER))
+
+
+def _load_layout(layout_yaml: str) -> Layout:
+    """Get a copy (which can be modified) of the validated layout for the given rendered
+    YAML. The YAML is only parsed and validated if it is not cached."""
+    return _validate_layout(layout_yaml).model_copy(deep=True)
+
+
 class CardGenerator:
     """A factory for generating social card images"""
 
     doc_src: str = ""
 
-    def __init__(self, context: JinjaContexts, config: Social_Cards):
-        self.context = context.model_dump()
-        self.context["math"] = math
+    def __init__(self, context: JinjaContexts | dict[str, Any], config: Social_Cards):
+        """The ``context`` can be given as a `dict` of already dumped contexts. Its
+        values are shared (not copied), so they must not be modified."""
+        ensure_qt_app()
+        if isinstance(context, JinjaContexts):
+            # resolve the default font first, so the layout context is the same for every card
+            assert config.cards_layout_options.font is not None
+            FontSourceManager.resolve(config.cards_layout_options.font, config.cache_dir)
+            context = context.model_dump()
+        self.context = {**context, "math": math}
         self.config = config
-        self.jinja_env = SandboxedEnvironment(
-            loader=FileSystemLoader(
-                [
-                    str(fp if Path(fp).is_absolute() else Path(self.doc_src, fp).resolve())
-                    for fp in config.cards_layout_dir
-                ]
-                + [str(_DEFAULT_LAYOUT_DIR)]
-            ),
-        )
-        self.jinja_env.block_start_string = "#%"
-        self.jinja_env.block_end_string = "%#"
-        self.jinja_env.variable_start_string = "'{{"
-        self.jinja_env.variable_end_string = "}}'"
-        self.jinja_env.comment_start_string = "##"
-        self.jinja_env.comment_end_string = "##"
-        # self.jinja_env.line_statement_prefix = "#%"
-        self.jinja_env.line_comment_prefix = "##"
-        self.jinja_env.finalize = lambda output: "null" if output is None else output
-        self.jinja_env.filters["yaml"] = (
-            lambda x: yaml.safe_dump(x, default_flow_style=True).rstrip("\n...\n").rstrip("\n")
-        )
+        self.layout_search_path = self.get_layout_search_path(config)
+        self.jinja_env = _get_jinja_env(self.layout_search_path)
+        #: The context paths accessed by the parsed layout.
+        self.dependencies: set[ContextPath] = set()
+
+    @classmethod
+    def get_layout_search_path(cls, config: Social_Cards) -> tuple[str, ...]:
+        """Get the directories in which the ``config``'s layouts are searched."""
+        return tuple(
+            str(fp if Path(fp).is_absolute() else Path(cls.doc_src, fp).resolve())
+            for fp in config.cards_layout_dir
+        ) + (str(_DEFAULT_LAYOUT_DIR),)
+
+    def get_dependencies(self) -> dict[ContextPath, str]:
+        """Get a digest of each context value accessed by the parsed layout."""
+        return context_digests(self.context, self.dependencies)
+
+    def get_inputs_digest(self, resources: list[str]) -> str:
+        """Get a digest of the inputs (other than the context) for the card. See
+        `dependencies.inputs_digest()`."""
+        return inputs_digest(self.config, self.layout_search_path, resources)
 
     def parse_layout(self, content: str | None = None):
         template: Template
+        self.dependencies = set()
+        context = TrackedDict.track(self.context, self.dependencies)
         if content is not None:
-            template = self.jinja_env.from_string(content)
-            parsed_yaml = template.render(self.context).strip()
+            template = _compile_template(self.layout_search_path, content)
+            parsed_yaml = template.render(context).strip()
             try:
-                self.config._parsed_layout = layout_validator.validate_python(
-                    yaml.safe_load(parsed_yaml)
-                )
+                self.config._parsed_layout = _load_layout(parsed_yaml)
             except Exception as exc:
                 LOGGER.error("Failed to parse layout:\n%s", parsed_yaml)
                 raise exc
         else:
-            for ext in (".yml", ".yaml", ".YML", ".YAML"):
-                try:
-                    template = self.jinja_env.get_template(self.config.cards_layout + ext)
-                    break
-                except TemplateNotFound:
-                    continue  # we'll raise the error when all extensions were tried
-            else:
-                raise ValueError(f"Could not find layout: '{self.config.cards_layout}'")
-            template_result = template.render(self.context)
+            template = _get_layout_template(self.layout_search_path, self.config.cards_layout)
+            template_result = template.render(context)
             try:
-                self.config._parsed_layout = layout_validator.validate_python(
-                    yaml.safe_load(template_result)
-                )
+                self.config._parsed_layout = _load_layout(template_result)
             except Exception as exc:
                 LOGGER.error(
                     "failed to parse %s template:\n%s",
@@ -135,10 +343,7 @@ class CardGenerator:
     def load_font(self, typography: Typography) -> QtAppFontInfo:
         typo_font = typography.font or self.config.cards_layout_options.font
         assert typo_font is not None and typo_font.path is not None
-        app_font_id = QFontDatabase.addApplicationFont(typo_font.path)
-        family = QFontDatabase.applicationFontFamilies(app_font_id)[0]
-        style = QFontDatabase.styles(family)[0]
-        return QtAppFontInfo(id=app_font_id, family=family, style=style)
+        return FontRegistry.get(typo_font.path)
 
     @staticmethod
     def calc_font_size(
@@ -147,29 +352,10 @@ class CardGenerator:
         max_height: float | int,
         font_db_info: QtAppFontInfo,
     ) -> QFont:
-        theoretical_height = max_height / line_amt
-        space = theoretical_height - (theoretical_height * line_height)
-        space = space * max(1, line_amt - 1) / line_amt
-        actual_height = theoretical_height - space
-        actual_height -= actual_height % 2
-        typo_font = QFontDatabase.font(
-            font_db_info.family, font_db_info.style, int(max(1, actual_height))
+        size = _solve_font_size(
+            font_db_info.family, font_db_info.style, line_amt, line_height, max_height
         )
-        metrics = QFontMetricsF(typo_font)
-        while metrics.height() > theoretical_height - space and actual_height > 2:
-            actual_height -= 2
-            typo_font = QFontDatabase.font(
-                font_db_info.family, font_db_info.style, int(actual_height)
-            )
-            metrics = QFontMetricsF(typo_font)
-        while metrics.height() < theoretical_height - space - 1:
-            actual_height += 2
-            typo_font = QFontDatabase.font(
-                font_db_info.family, font_db_info.style, int(actual_height)
-            )
-            metrics = QFontMetricsF(typo_font)
-
-        return typo_font
+        return QFontDatabase.font(font_db_info.family, font_db_info.style, size)
 
     def make_text_block(
         self,
@@ -177,16 +363,69 @@ class CardGenerator:
         layer: Layer,
         canvas: QPainter,
         font_db_info: QtAppFontInfo,
-    ) -> tuple[list[str], QTextLayout, QTextOption]:
+    ) -> tuple[list[str], QTextLayout, QTextOption, int]:
+        """Break the typography's content into lines.
+
+        If the content overflows and `Typography.overflow` is enabled, then the smallest
+        amount of lines (not less than the configured `Line.amount`) whose font fits the
+        content is used. Returns the lines, the text layout, its options, and the amount
+        of lines that was used to size the font.
+        """
         assert layer.size is not None
-        font = self.calc_font_size(
-            typography.line.amount,
-            typography.line.height,
-            layer.size.height - typography.border.width,
-            font_db_info,
-        )
+        max_width = layer.size.width - typography.border.width
+        max_height = layer.size.height - typography.border.width
+        tokens = _tokenize(typography.content)
+
+        measured: dict[int, tuple[QFont, QFontMetricsF, dict[str, tuple[float, float]]]] = {}
+
+        def measure(line_amt: int):
+            if line_amt not in measured:
+                font = self.calc_font_size(
+                    line_amt, typography.line.height, max_height, font_db_info
+                )
+                metrics = QFontMetricsF(font)
+                # each distinct token is only measured once per font size
+                widths = {
+                    t: (metrics.horizontalAdvance(t), metrics.boundingRect(t).right())
+                    for t in set(tokens) | {" "}
+                }
+                measured[line_amt] = (font, metrics, widths)
+            return measured[line_amt]
+
+        def fits(line_amt: int) -> bool:
+            widths = measure(line_amt)[2]
+            return _break_lines(tokens, widths, line_amt, max_width, True) is not None
+
+        line_amt = typography.line.amount
+        if typography.overflow and not fits(line_amt):
+            # grow the amount of lines exponentially until the content fits, then
+            # narrow it down to the smallest amount of lines that fits
+            lo, hi = line_amt, line_amt * 2
+            while not fits(hi) and measure(hi)[0].pointSize() > 1:
+                lo, hi = hi, hi * 2
+            while lo + 1 < hi:
+                mid = (lo + hi) // 2
+                if fits(mid):
+                    hi = mid
+                else:
+                    lo = mid
+            line_amt = hi
+
+        font, metrics, widths = measure(line_amt)
+        # if the content still does not fit (even with the smallest font), then truncate it
+        result = _break_lines(tokens, widths, line_amt, max_width, False)
+        assert result is not None
+        display_lines, truncated = result
+        if truncated is not None:
+            if display_lines[-1]:
+                display_lines[-1] = metrics.elidedText(
+                    display_lines[-1] + truncated,
+                    Qt.TextElideMode.ElideRight,
+                    layer.size.width,
+                )
+            else:  # append ellipses to the empty line
+                display_lines[-1] = "…"
         canvas.setFont(font)
-        metrics = QFontMetricsF(canvas.font())
 
         align = [a.lower() for a in typography.align.split()[:2]]
         anchor_translator = (
@@ -207,58 +446,14 @@ class CardGenerator:
         font_flags.setWrapMode(QTextOption.WrapMode.NoWrap)
         font_flags.setFlags(QTextOption.Flag.ShowLineAndParagraphSeparators)
 
-        display_lines: list[str] = [""]
-        line_count = 0
-        max_width = layer.size.width - typography.border.width
-        for word in re.split(r"([\0\s\n])", _insert_wbr(typography.content, "\0")):
-            if word == "\0" or (word == " " and not display_lines[line_count]):
-                continue
-            elif word == "\n":
-                if line_count < typography.line.amount - 1:
-                    display_lines.append("")
-                    line_count += 1
-                    continue
-                elif line_count == typography.line.amount - 1 and typography.overflow:
-                    typography.line.amount += 1
-                    display_lines.clear()
-                    return self.make_text_block(typography, layer, canvas, font_db_info)
-                else:
-                    word = " "  # just discard the token if we can't add another line
-            test_str = display_lines[line_count] + word
-            rect = metrics.boundingRect(test_str, font_flags)
-            if rect.width() - rect.x() < max_width:  # text fits!
-                display_lines[line_count] += word
-            # text does not fit!
-            elif line_count + 1 < typography.line.amount:
-                # line capacity filled and more lines available
-                display_lines.append(word)
-                display_lines[line_count] = display_lines[line_count].strip()
-                line_count += 1
-            elif typography.overflow:  # no lines left but overflow is allowed
-                # shrink font by adding 1 to the max lines and try again
-                typography.line.amount += 1
-                display_lines.clear()
-                return self.make_text_block(typography, layer, canvas, font_db_info)
-            else:  # text has overflow but typography.overflow is disabled
-                if display_lines[line_count]:
-                    truncated = metrics.elidedText(
-                        display_lines[line_count] + word,
-                        Qt.TextElideMode.ElideRight,
-                        layer.size.width,
-                    )
-                    display_lines[line_count] = truncated
-                else:  # append ellipses to the empty line
-                    display_lines[line_count] = "…"
-                break
-
         text_layout = QTextLayout("\n".join(display_lines), canvas.font(), canvas.device())
         text_layout.setFlags(font_flags.flags().value)
-        return display_lines, text_layout, font_flags
+        return display_lines, text_layout, font_flags, line_amt
 
     def render_text(self, layer: Layer, typography: Typography, canvas: QPainter):
         """Renders text into the social card"""
         font_db_info = self.load_font(typography)
-        raw_text, text_layout, font_flags = self.make_text_block(
+        raw_text, text_layout, font_flags, line_amt = self.make_text_block(
             typography, layer, canvas, font_db_info
         )
 
@@ -275,10 +470,10 @@ class CardGenerator:
 
         metrics = QFontMetricsF(canvas.font())
         assert layer.size is not None
-        padding = layer.size.height - (metrics.height() * typography.line.amount)
-        padding /= typography.line.amount
+        padding = layer.size.height - (metrics.height() * line_amt)
+        padding /= line_amt
         padding *= len(raw_text)
-        padding /= max(1, typography.line.amount - 1)
+        padding /= max(1, line_amt - 1)
 
         y_offset = 0
         layer_rect = QRectF(0, 0, layer.size.width, layer.size.height)
@@ -314,7 +509,6 @@ class CardGenerator:
                     canvas.drawPolygon(poly)
         text_layout.endLayout()
         # text_layout.draw(canvas, QPointF(0, 0))
-        QFontDatabase.removeApplicationFont(font_db_info.id)
 
     def get_image(self, layer: Layer, img_config: LayerImage):
         """Renders an image into the social card"""
@@ -334,8 +528,12 @@ class CardGenerator:
         img_path, color = self.get_image(layer, img_config)
         if img_path is not None:
             assert layer.size is not None
-            img = resize_image(img_path, layer.size, img_config.preserve_aspect)
-            if color:
+            # a gradient depends on the layer's offset, so only cache images tinted by a color
+            tint = color if isinstance(color, QColor) else None
+            img = ImageCache.get(
+                img_path, layer.size, img_config.preserve_aspect, tint, self.config.cache_dir
+            )
+            if color and tint is None:
                 img = overlay_color(img, color, mask=True)
             canvas.drawImage(0, 0, img)
 
@@ -345,7 +543,9 @@ class CardGenerator:
         img = None
         assert layer.size is not None
         if img_path is not None:
-            img = resize_image(img_path, layer.size, img_config.preserve_aspect)
+            img = ImageCache.get(
+                img_path, layer.size, img_config.preserve_aspect, cache_dir=self.config.cache_dir
+            )
         if color is not None:
             if not img:
                 img = QImage(
@@ -406,28 +606,14 @@ class CardGenerator:
                 assert layer.size is not None
                 # drawing arc w/o border to origin should be clipped so arc endpoints coincide w/
                 # pieslice boundary
-                _tmp_canvas = QImage(
-                    layer.size.width,
-                    layer.size.height,
-                    QImage.Format.Format_ARGB32_Premultiplied,
-                )
-                _tmp_canvas.fill(Qt.GlobalColor.transparent)
-                _mask_canvas = _tmp_canvas.copy()
-                with QPainter(_mask_canvas) as painter:
-                    pen_mask = QPen(pen)
-                    pen_mask.setWidth(1)
-                    painter.setPen(pen_mask)
-                    painter.setBrush(Qt.GlobalColor.white)
-                    painter.drawPie(_tmp_canvas.rect(), start, end)
-                with QPainter(_tmp_canvas) as painter:
-                    painter.setPen(pen)
-                    painter.setBrush(brush)
-                    painter.drawEllipse(rect)
-                    painter.setCompositionMode(
-                        QPainter.CompositionMode.CompositionMode_DestinationIn
-                    )
-                    painter.drawImage(0, 0, _mask_canvas)
-                canvas.drawImage(0, 0, _tmp_canvas)
+                layer_rect = QRectF(0, 0, layer.size.width, layer.size.height)
+                pie = QPainterPath(layer_rect.center())
+                pie.arcTo(layer_rect, start / 16, end / 16)
+                pie.closeSubpath()
+                canvas.save()
+                canvas.setClipPath(pie, Qt.ClipOperation.IntersectClip)
+                canvas.drawEllipse(rect)
+                canvas.restore()
         else:  # drawing a full ellipse
             canvas.drawEllipse(rect)
 
@@ -510,33 +696,18 @@ class CardGenerator:
             canvas.drawRoundedRect(rect, shape_config.radius, shape_config.radius)
             return
         assert layer.size is not None
-        _pointed_rect = QImage(
-            layer.size.width,
-            layer.size.height,
-            QImage.Format.Format_ARGB32_Premultiplied,
-        )
-        _pointed_rect.fill(Qt.GlobalColor.transparent)
-        _rounded_rect = _pointed_rect.copy()
-        _combined_rect = _pointed_rect.copy()
-        with QPainter(_pointed_rect) as painter:
-            painter.setPen(pen)
-            painter.setBrush(brush)
-            painter.drawRect(rect)
-        with QPainter(_rounded_rect) as painter:
-            painter.setPen(pen)
-            painter.setBrush(brush)
-            painter.drawRoundedRect(rect, shape_config.radius, shape_config.radius)
-        with QPainter(_combined_rect) as painter:
-            assert layer.size is not None
-            w, h = layer.size.width / 2, layer.size.height / 2
-            for i, is_rounded in enumerate(corners):
-                clipping_rect = QRectF(w * (i % 2), h * int(i / 2), w, h)
-                painter.drawImage(
-                    clipping_rect,
-                    _rounded_rect if is_rounded else _pointed_rect,
-                    clipping_rect,
-                )
-        canvas.drawImage(0, 0, _combined_rect)
+        # draw each quarter of the rectangle with either a rounded or pointed corner
+        w, h = layer.size.width / 2, layer.size.height / 2
+        for i, is_rounded in enumerate(corners):
+            canvas.save()
+            canvas.setClipRect(
+                QRectF(w * (i % 2), h * int(i / 2), w, h), Qt.ClipOperation.IntersectClip
+            )
+            if is_rounded:
+                canvas.drawRoundedRect(rect, shape_config.radius, shape_config.radius)
+            else:
+                canvas.drawRect(rect)
+            canvas.restore()
 
     def render_debugging(
         self,
@@ -576,71 +747,185 @@ class CardGenerator:
             f" {index} - {layer.size.width},{layer.size.height} ",
             Qt.AlignmentFlag.AlignBottom | Qt.AlignmentFlag.AlignRight,
         )
-        QFontDatabase.removeApplicationFont(font_db_info.id)
 
-    def render_layer(self, layer: Layer) -> QImage:
+    def draw_layer(self, canvas: QPainter, layer: Layer):
+        """Renders a layer onto the ``canvas`` at the layer's offset.
+
+        The layer is drawn directly onto the ``canvas`` (clipped to the layer's size).
+        Only a layer with a mask is rendered on off-screen canvases first.
+        """
         if layer.size is None:
             layer.size = self.config._parsed_layout.size
-        _tmp_canvas = QImage(
-            layer.size.width,
-            layer.size.height,
-            QImage.Format.Format_ARGB32_Premultiplied,
+        canvas.save()
+        canvas.translate(layer.offset.x, layer.offset.y)
+        canvas.setClipRect(
+            QRectF(0, 0, layer.size.width, layer.size.height), Qt.ClipOperation.IntersectClip
         )
-        _tmp_canvas.fill(Qt.GlobalColor.transparent)
-        with QPainter(_tmp_canvas) as _painter:
-            if layer.background is not None:
-                self.render_background(layer, layer.background, _painter)
-            if layer.rectangle is not None:
-                self.render_rectangle(layer, layer.rectangle, _painter)
-            if layer.ellipse is not None:
-                self.render_ellipse(layer, layer.ellipse, _painter)
-            if layer.polygon is not None:
-                self.render_polygon(layer, layer.polygon, _painter)
-            if layer.icon is not None:
-                self.render_icon(layer, layer.icon, _painter)
-            if layer.typography is not None:
-                self.render_text(layer, layer.typography, _painter)
-            if layer.mask is not None:
-                mask = self.render_layer(layer.mask)
-                _masked = QImage(
-                    _tmp_canvas.size(),
-                    QImage.Format.Format_ARGB32_Premultiplied,
-                )
-                _masked.fill(Qt.GlobalColor.transparent)
-                with QPainter(_masked) as mask_painter:
-                    src_rect = _masked.rect()
-                    tgt_rect = QRectF(
-                        layer.mask.offset.x,
-                        layer.mask.offset.y,
-                        src_rect.width(),
-                        src_rect.height(),
-                    )
-                    mask_painter.drawImage(tgt_rect, mask, src_rect)
-                if layer.mask.invert:
-                    _painter.setCompositionMode(
-                        QPainter.CompositionMode.CompositionMode_DestinationOut
-                    )
-                else:
-                    _painter.setCompositionMode(
-                        QPainter.CompositionMode.CompositionMode_DestinationIn
-                    )
-                _painter.drawImage(0, 0, _masked)
-        return _tmp_canvas
+        if layer.mask is None:
+            self.draw_layer_content(canvas, layer)
+        else:
+            with _CanvasPool.borrow(layer.size.width, layer.size.height) as _tmp_canvas:
+                with QPainter(_tmp_canvas) as _painter:
+                    self.draw_layer_content(_painter, layer)
+                    with _CanvasPool.borrow(layer.size.width, layer.size.height) as _masked:
+                        with QPainter(_masked) as mask_painter:
+                            self.draw_layer(mask_painter, layer.mask)
+                        if layer.mask.invert:
+                            _painter.setCompositionMode(
+                                QPainter.CompositionMode.CompositionMode_DestinationOut
+                            )
+                        else:
+                            _painter.setCompositionMode(
+                                QPainter.CompositionMode.CompositionMode_DestinationIn
+                            )
+                        _painter.drawImage(0, 0, _masked)
+                canvas.drawImage(0, 0, _tmp_canvas)
+        canvas.restore()
+
+    def draw_layer_content(self, canvas: QPainter, layer: Layer):
+        """Renders the parts of a layer (excluding its mask) in the layer's coordinates."""
+        if layer.background is not None:
+            self.render_background(layer, layer.background, canvas)
+        if layer.rectangle is not None:
+            self.render_rectangle(layer, layer.rectangle, canvas)
+        if layer.ellipse is not None:
+            self.render_ellipse(layer, layer.ellipse, canvas)
+        if layer.polygon is not None:
+            self.render_polygon(layer, layer.polygon, canvas)
+        if layer.icon is not None:
+            self.render_icon(layer, layer.icon, canvas)
+        if layer.typography is not None:
+            self.render_text(layer, layer.typography, canvas)
+
+    def load_fonts(self):
+        """Resolves the path to each font used in the parsed layout."""
+        for font in self.config.get_fonts():
+            FontSourceManager.resolve(font, self.config.cache_dir)
+
+    def prefetch_images(self):
+        """Download the remote images used in the parsed layout concurrently."""
+        downloads: list[tuple[str, Path]] = []
+        for layer in self.config._parsed_layout.layers:
+            mask: Layer | None = layer
+            while mask is not None:
+                for img_config in (mask.background, mask.icon):
+                    if img_config is not None and "://" in str(img_config.image):
+                        url = str(img_config.image).strip()
+                        downloads.append((url, download_path(self.config.cache_dir, url)))
+                mask = mask.mask
+        Fetcher.prefetch(downloads)
+
+    def get_resources(self) -> list[str]:
+        """Get the paths to the font and image files used in the parsed layout."""
+        self.load_fonts()
+        resources = {str(font.path) for font in self.config.get_fonts()}
+        for layer in self.config._parsed_layout.layers:
+            mask: Layer | None = layer
+            while mask is not None:
+                for img_config in (mask.background, mask.icon):
+                    if img_config is not None:
+                        img_path, _ = self.get_image(mask, img_config)
+                        if img_path is not None:
+                            resources.add(str(img_path))
+                mask = mask.mask
+        return sorted(resources)
+
+    def get_layer_src(self, layer: Layer) -> dict:
+        """Serialize a layer's (validated) config for hashing.
+
+        The font and image files that the layer uses are identified by a hash of their
+        content instead of their path, so the result does not depend on where the
+        files are located.
+        """
+        src = layer.model_dump(mode="json")
+        for name in ("background", "icon"):
+            img_config: LayerImage | None = getattr(layer, name)
+            if img_config is not None:
+                img_path, _ = self.get_image(layer, img_config)
+                src[name]["image"] = None if img_path is None else file_digest(img_path)
+        if layer.typography is not None:
+            font = layer.typography.font or self.config.cards_layout_options.font
+            assert font is not None and font.path is not None
+            src["typography"]["font"] = {
+                **font.model_dump(mode="json"),
+                "path": file_digest(font.path),
+            }
+        if layer.mask is not None:
+            src["mask"] = self.get_layer_src(layer.mask)
+        return src
+
+    def get_layer_digests(self) -> tuple[str, ...]:
+        """Get a hash of each layer in the parsed layout.
+
+        Each hash covers the layer's (validated) config, the content of the font and
+        image files that the layer uses, and the options that affect the layer but are
+        not part of the layout. This must be called before the layers are rendered.
+        """
+        self.load_fonts()
+        card_src = {
+            "size": self.config._parsed_layout.size.model_dump(),
+            "color": serialize_color(self.config.cards_layout_options.color),
+        }
+        digests: list[str] = []
+        for layer in self.config._parsed_layout.layers:
+            key_src = {**card_src, "layer": self.get_layer_src(layer)}
+            digests.append(
+                hashlib.sha256(json.dumps(key_src, default=str).encode("utf-8")).hexdigest()
+            )
+        return tuple(digests)
+
+    def get_cache_key(self) -> str:
+        """Get a key that uniquely identifies the card rendered from the parsed layout.
+
+        This must be called after `parse_layout()`. The key is a hash of a canonical
+        serialization of the validated layout, the content of the font and image files
+        used, the options that affect the rendered (and encoded) card but are not part of
+        the layout, and this extension's version. No file paths are included, so the key
+        is the same across processes and machines.
+        """
+        self.load_fonts()
+        self.prefetch_images()
+        key_src = {
+            "version": CACHE_VERSION,
+            "size": self.config._parsed_layout.size.model_dump(mode="json"),
+            "layers": [self.get_layer_src(layer) for layer in self.config._parsed_layout.layers],
+            "color": serialize_color(self.config.cards_layout_options.color),
+            "debug": cast(Debug, self.config.debug).model_dump(mode="json"),
+            "output_format": cast(Output_Format, self.config.output_format).model_dump(),
+        }
+        canonical = json.dumps(key_src, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def paint_layers(self, canvas: QImage, layers: list[Layer]):
+        """Render the given layers onto the ``canvas``."""
+        with QPainter(canvas) as _painter:
+            for layer in layers:
+                self.draw_layer(_painter, layer)
 
     def render_card(self) -> QImage:
-        FontSourceManager.cache_path = Path(self.config.cache_dir, "fonts")
-        for font in self.config.get_fonts():
-            FontSourceManager.get_font(font)
-        _canvas = QImage(
-            self.config._parsed_layout.size.width,
-            self.config._parsed_layout.size.height,
-            QImage.Format.Format_ARGB32_Premultiplied,
-        )
-        _canvas.fill(Qt.GlobalColor.transparent)
+        self.load_fonts()
+        layers = self.config._parsed_layout.layers
+        digests = self.get_layer_digests()
+        # start from the leading layers that were already rendered for another card
+        start, _canvas = LayerAtlas.get(digests)
+        if _canvas is None:
+            _canvas = QImage(
+                self.config._parsed_layout.size.width,
+                self.config._parsed_layout.size.height,
+                QImage.Format.Format_ARGB32_Premultiplied,
+            )
+            _canvas.fill(Qt.GlobalColor.transparent)
+        shared = LayerAtlas.shared_prefix(digests)
+        if shared > start:
+            # these layers are the same as the previous card's, so keep them for later cards
+            self.paint_layers(_canvas, layers[start:shared])
+            LayerAtlas.put(digests[:shared], _canvas)
+            start = shared
+        for layer in layers[:start]:
+            if layer.size is None:  # the layer was not rendered, but it may be debugged
+                layer.size = self.config._parsed_layout.size
+        self.paint_layers(_canvas, layers[start:])
         with QPainter(_canvas) as _painter:
-            for layer in self.config._parsed_layout.layers:
-                _tmp_canvas = self.render_layer(layer)
-                _painter.drawImage(layer.offset.x, layer.offset.y, _tmp_canvas)
             assert not isinstance(self.config.debug, bool)
             if self.config.debug.enable:
                 color = self.config.debug.color
@@ -1,7 +1,8 @@
+import hashlib
+import json
 from logging import getLogger
 from pathlib import Path
 from typing import cast, Literal
-from urllib.parse import urlparse, quote
 from material_design_icons_pack import get_icon as mdi_get_icon
 from simple_icons_pack import get_icon as simple_get_icon
 from fontawesome_free_pack import get_icon as fa_get_icon
@@ -11,7 +12,17 @@ from PySide6.QtGui import QImage, QImageReader, QPainter, QBrush
 from PySide6.QtCore import Qt, QSize, QRect
 from PySide6.QtGui import QColor
 from PySide6.QtSvg import QSvgRenderer
-from .validators import try_request
+from .cache import (
+    CACHE_VERSION,
+    LRUCache,
+    atomic_write,
+    cache_path,
+    download_path,
+    file_digest,
+    touch,
+)
+from .encoders import encode_image
+from .fetch import Fetcher
 from .validators.layout import Size
 
 LOGGER = getLogger(__name__)
@@ -75,13 +86,7 @@ def find_image(
         return None
     if "://" in str(img_name):
         url = str(img_name).strip()
-        file_name = Path(cache_dir, quote(urlparse(url).path, safe="."))
-        if not file_name.suffix:
-            file_name = file_name.with_suffix(".png")
-        if not file_name.exists():
-            response = try_request(url)
-            file_name.write_bytes(response.content)
-        img_name = file_name
+        img_name = Fetcher.download(url, download_path(cache_dir, url))
     if isinstance(img_name, str):
         img_name = img_name.strip()
         tmp_file_path = Path(img_name)
@@ -207,6 +212,26 @@ def resize_image(
     return img.copy(img.rect())
 
 
+def downsample_image(img_path: Path, max_size: int) -> bool:
+    """Shrink an image file (in place) so that its width and height are no bigger than
+    ``max_size``. Returns :python:`True` if the image was shrunk."""
+    reader = QImageReader(str(img_path))
+    img_size = reader.size()
+    if not img_size.isValid() or max(img_size.width(), img_size.height()) <= max_size:
+        return False
+    img = reader.read()
+    if img.isNull():
+        return False
+    img = img.scaled(
+        max_size,
+        max_size,
+        Qt.AspectRatioMode.KeepAspectRatio,
+        Qt.TransformationMode.SmoothTransformation,
+    )
+    atomic_write(img_path, encode_image(img))
+    return True
+
+
 def overlay_color(img: QImage, color: QColor | QBrush, mask: bool = False) -> QImage:
     if mask:
         paint_bucket = QImage(img.size(), QImage.Format.Format_ARGB32_Premultiplied)
@@ -228,3 +253,66 @@ def overlay_color(img: QImage, color: QColor | QBrush, mask: bool = False) -> QI
             assert isinstance(color, QColor)
             painter.fillRect(img.rect(), color)
     return img
+
+
+class ImageCache:
+    """A process-wide cache of decoded and resized images.
+
+    Images are kept in memory (least recently used first out) until their total size
+    exceeds `max_bytes`. If a ``cache_dir`` is given to `get()`, then the resized images
+    are also saved in a ``resized`` subfolder of that path, so later builds do not need to
+    decode and resize the source images again.
+    """
+
+    #: The maximum total size (in bytes) of images kept in memory. :python:`None` means no
+    #: limit.
+    max_bytes: int | None = 64 * 1024 * 1024
+    _images: LRUCache[tuple, QImage] = LRUCache(weigh=QImage.sizeInBytes)
+
+    @classmethod
+    def get(
+        cls,
+        img_path: str | Path,
+        size: Size,
+        aspect: bool | Literal["width", "height"],
+        color: QColor | None = None,
+        cache_dir: str | Path | None = None,
+    ) -> QImage:
+        """Get an image resized with `resize_image()`. If a ``color`` is given, then the
+        resized image is also used as a mask for the ``color`` (see `overlay_color()`).
+
+        The returned image shares its data with the cached image until it is modified.
+        """
+        img_path = Path(img_path)
+        stat = img_path.stat()
+        tint = None if color is None else color.name(QColor.NameFormat.HexArgb)
+        spec = (size.width, size.height, aspect, tint)
+        key = (str(img_path), stat.st_mtime_ns, stat.st_size) + spec
+        cached = cls._images.get(key)
+        if cached is not None:
+            return QImage(cached)
+
+        img = QImage()
+        disk_path = None
+        if cache_dir is not None:
+            name_src = json.dumps([CACHE_VERSION, file_digest(img_path), *spec])
+            name = hashlib.sha256(name_src.encode("utf-8")).hexdigest()[:32]
+            disk_path = Path(cache_path(cache_dir, "resized"), name).with_suffix(".png")
+            if disk_path.exists():
+                img = QImage(str(disk_path))
+                touch(disk_path)
+        if img.isNull():
+            img = resize_image(img_path, size, aspect)
+            if color is not None:
+                img = overlay_color(img, color, mask=True)
+            if disk_path is not None:
+                atomic_write(disk_path, encode_image(img))
+        img = img.convertToFormat(QImage.Format.Format_ARGB32_Premultiplied)
+        cls._images.put(key, img)
+        cls._images.evict(max_weight=cls.max_bytes)
+        return QImage(img)
+
+    @classmethod
+    def clear(cls):
+        """Discard all images kept in memory."""
+        cls._images.clear()
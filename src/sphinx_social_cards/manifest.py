@@ -0,0 +1,146 @@
+"""A build-wide manifest of the generated social cards.
+
+Each card that is written to the build output is recorded in the build environment (as
+a `CardRecord`). So, the manifest persists between incremental builds. When the build
+is finished, any card image in the `path <Social_Cards.path>` that is not in the
+manifest is stale (its document was changed or removed) and is deleted. The manifest is
+then saved as a ``manifest.json`` file in the same folder for use in other tooling.
+"""
+
+import json
+from pathlib import Path
+import re
+from typing import NamedTuple
+
+from sphinx.application import Sphinx
+from sphinx.environment import BuildEnvironment
+from sphinx.util.logging import getLogger
+
+from .cache import atomic_write
+from .dependencies import ContextPath
+from .plugins import SPHINX_SOCIAL_CARDS_CONFIG_KEY
+from .validators import Social_Cards
+
+LOGGER = getLogger(__name__)
+_MANIFEST_ENV_KEY = "sphinx_social_cards_manifest"
+_PREVIOUS_ENV_KEY = "sphinx_social_cards_previous_records"
+_READ_ENV_KEY = "sphinx_social_cards_read_docs"
+#: The name of the manifest file saved in the `path <Social_Cards.path>`.
+MANIFEST_NAME = "manifest.json"
+# matches the names of generated cards: <docname>-<hash>.<suffix>
+_CARD_NAME = re.compile(r"-[0-9a-f]{16}\.\w+$")
+
+
+class CardRecord(NamedTuple):
+    """The information about a card in the build output."""
+
+    #: The name of the document that uses the card.
+    docname: str
+    #: The hash used in the card's file name.
+    hash: str
+    #: The size (in bytes) of the card's image file. This is :python:`None` until a
+    #: deferred card is rendered.
+    size: int | None
+    #: The name of the layout used (or :python:`None` if the layout was given as the
+    #: :rst:dir:`social-card` directive's content).
+    layout: str | None
+    #: The key that identifies the card in the `RenderCache`.
+    cache_key: str
+    #: The paths to the font and image files used by the card.
+    resources: list[str]
+    #: A digest of each context value accessed by the card's layout (see
+    #: `dependencies.context_digests()`).
+    context: dict[ContextPath, str] = {}
+    #: A digest of the card's other inputs (see `dependencies.inputs_digest()`). This is
+    #: empty if the card cannot be checked for changes (eg. the card was generated by
+    #: a :rst:dir:`social-card` directive).
+    inputs: str = ""
+    #: The card's width and height (in pixels).
+    img_size: tuple[int, int] | None = None
+
+
+def get_manifest(env: BuildEnvironment) -> dict[str, CardRecord]:
+    """Get the manifest of cards (mapped by their path relative to the build output)
+    from the build environment."""
+    if not hasattr(env, _MANIFEST_ENV_KEY):
+        setattr(env, _MANIFEST_ENV_KEY, {})
+    return getattr(env, _MANIFEST_ENV_KEY)
+
+
+def record_card(env: BuildEnvironment, outdir: str | Path, img_path: Path, record: CardRecord):
+    """Add (or replace) a card in the manifest."""
+    uri = img_path.relative_to(outdir).as_posix()
+    get_manifest(env)[uri] = record
+
+
+def get_read_docs(env: BuildEnvironment) -> set[str]:
+    """Get the names of the documents that were read (and so, have all their cards
+    recorded in the manifest)."""
+    if not hasattr(env, _READ_ENV_KEY):
+        setattr(env, _READ_ENV_KEY, set())
+    return getattr(env, _READ_ENV_KEY)
+
+
+def update_card_size(env: BuildEnvironment, outdir: str | Path, img_path: Path):
+    """Update the recorded size of a card after it has been written."""
+    manifest = get_manifest(env)
+    uri = img_path.relative_to(outdir).as_posix()
+    if uri in manifest:
+        manifest[uri] = manifest[uri]._replace(size=img_path.stat().st_size)
+
+
+def get_previous_records(env: BuildEnvironment) -> dict[str, tuple[str, CardRecord]]:
+    """Get the records (mapped by document) that were purged from the manifest because
+    their document is read again. Each record is paired with its path relative to the
+    build output."""
+    if not hasattr(env, _PREVIOUS_ENV_KEY):
+        setattr(env, _PREVIOUS_ENV_KEY, {})
+    return getattr(env, _PREVIOUS_ENV_KEY)
+
+
+def purge_records(app: Sphinx, env: BuildEnvironment, docname: str):
+    get_read_docs(env).discard(docname)
+    manifest = get_manifest(env)
+    for uri in [k for k, record in manifest.items() if record.docname == docname]:
+        record = manifest.pop(uri)
+        if record.inputs:  # keep the record, so the card can be reused if unchanged
+            get_previous_records(env)[docname] = (uri, record)
+
+
+def discard_previous_records(app: Sphinx, env: BuildEnvironment):
+    get_previous_records(env).clear()
+
+
+def merge_records(app: Sphinx, env: BuildEnvironment, docnames: set[str], other: BuildEnvironment):
+    # collect cards recorded by parallel readers
+    get_manifest(env).update(get_manifest(other))
+    get_read_docs(env).update(get_read_docs(other))
+
+
+def prune_cards(app: Sphinx, exception: Exception | None):
+    """Delete the stale cards in the build output and save the manifest."""
+    if exception is not None:
+        return
+    conf: Social_Cards = getattr(app.config, SPHINX_SOCIAL_CARDS_CONFIG_KEY)
+    card_dir = Path(app.outdir, conf.path)
+    if not card_dir.is_dir():
+        return
+    manifest = get_manifest(app.env)
+    pruned = 0
+    # only prune if every document's cards are recorded; otherwise (eg. the environment
+    # was saved by an older version), any card may still be in use
+    if set(app.env.all_docs) <= get_read_docs(app.env):
+        for img_path in card_dir.rglob("*"):
+            if not img_path.is_file() or not _CARD_NAME.search(img_path.name):
+                continue
+            if img_path.relative_to(app.outdir).as_posix() not in manifest:
+                img_path.unlink()
+                pruned += 1
+    if pruned:
+        LOGGER.info("removed %d stale social card(s)", pruned)
+    manifest_src = {}
+    for uri, record in sorted(manifest.items()):
+        record_src = record._asdict()
+        record_src["context"] = {".".join(path): val for path, val in record.context.items()}
+        manifest_src[uri] = record_src
+    atomic_write(Path(card_dir, MANIFEST_NAME), json.dumps(manifest_src, indent=2).encode())
@@ -3,7 +3,7 @@ from typing import cast, Type
 import sphinx
 from sphinx.builders.html import StandaloneHTMLBuilder
 import docutils.nodes
-from .validators import Social_Cards
+from .validators import Social_Cards, Output_Format
 
 
 meta_node_types: tuple[Type[docutils.nodes.Element], ...]
@@ -27,14 +27,18 @@ def complete_doc_meta_data(
     card_config: Social_Cards,
     page_name: str,
     img_hash: str,
+    img_size: tuple[int, int] | None = None,
 ) -> tuple[str | None, dict[str, str]]:
+    """Get the card's URI and the meta data to add to the document. The card's
+    ``img_size`` is taken from the ``card_config``'s parsed layout if not given."""
     new_meta_data: dict[str, str] = {}
     if not isinstance(builder, StandaloneHTMLBuilder):
         return (None, new_meta_data)  # nothing left to do then
     uri = builder.get_target_uri(page_name)
     site_url = card_config.site_url.rstrip("/")
     page_url = "/".join([site_url, uri])
-    uri = uri.rstrip(builder.link_suffix) + f"-{img_hash}.png"
+    encoder = cast(Output_Format, card_config.output_format).encoder
+    uri = uri.rstrip(builder.link_suffix) + f"-{img_hash}{encoder.suffix}"
     img_url = "/".join([site_url, card_config.path, uri])
 
     def update_meta(id_: dict[str, str], content: str):
@@ -49,12 +53,10 @@ def complete_doc_meta_data(
     update_meta(id_={"name": "twitter:card"}, content="summary_large_image")
     update_meta(id_={"property": "og:type"}, content="website")
     update_meta(id_={"property": "og:url"}, content=page_url)
-    for key, val in dict(
-        type="image/png",
-        width=card_config._parsed_layout.size.width,
-        height=card_config._parsed_layout.size.height,
-    ).items():
-        update_meta(id_={"property": f"og:{key}"}, content=str(val))
+    if img_size is None:
+        img_size = (card_config._parsed_layout.size.width, card_config._parsed_layout.size.height)
+    for key, val in dict(type=encoder.mime_type, width=img_size[0], height=img_size[1]).items():
+        update_meta(id_={"property": f"og:image:{key}"}, content=str(val))
     for key, val in dict(title=title, description=description, image=img_url).items():
         assert val is not None, f"{key} cannot be None"
         update_meta(id_={"property": f"og:{key}"}, content=val)
@@ -33,6 +33,18 @@ value to set the repository URL.
     also be parsed from the `site_url <Social_Cards.site_url>` if it uses a standard
     GitHub Pages address (:html:`https://<owner>.github.io/<repo>`).
 
+.. confval:: github_avatar_size
+
+    .. code-block:: python
+        :caption: conf.py
+
+        github_avatar_size = 256
+
+    The avatar images (of the owner, organizations, and contributors) are downloaded
+    before any social cards are rendered. Each avatar is downsampled to this size (in
+    pixels). This should be the largest size of an avatar used in the layouts. Defaults
+    to :python:`180` (the size of the avatar in the ``github/default`` layouts).
+
 .. tip::
     Information from GitHub is fetched using GitHub's REST API endpoints. If there is a
     need to authenticate HTTP GET requests from the REST API, then set an environment
@@ -61,8 +73,10 @@ or using the ``sphinx-social-cards`` package's optional dependency:
 .. abstract:: Implementation details about the cached information
     :collapsible:
 
-    By default, the cache of owner/repository information is updated once a day (unless
-    the cache is purged).
+    The REST API responses are cached. A cached response is revalidated (using its
+    ``ETag``) when it is more than an hour old, so unchanged information is not
+    downloaded again. All REST API endpoints are requested concurrently, and the
+    repository's contributors and tags are fetched from all pages (up to 1000 items).
 
     .. literalinclude:: ../../src/sphinx_social_cards/plugins/github/utils.py
         :caption: How the cache location is chosen via appdirs_ API
@@ -74,13 +88,11 @@ or using the ``sphinx-social-cards`` package's optional dependency:
            OS used:
 
            - On Windows:
-             ``%LOCALAPPDATA%\\2bndy5\\sphinx_social_cards.plugins.github\\Cache\\<month>
-             <day> <year>``
+             ``%LOCALAPPDATA%\\2bndy5\\sphinx_social_cards.plugins.github\\Cache\\api``
            - On Linux:
-             ``/home/$(whoami)/.cache/sphinx_social_cards.plugins.github/<month> <day> <year>``
+             ``/home/$(whoami)/.cache/sphinx_social_cards.plugins.github/api``
            - On MacOS:
-             ``/Users/$(id -un)/Library/Caches/sphinx_social_cards.plugins.github/<month> <day>
-             <year>``
+             ``/Users/$(id -un)/Library/Caches/sphinx_social_cards.plugins.github/api``
 """
 
 from pathlib import Path
@@ -88,7 +100,7 @@ from pathlib import Path
 from sphinx.application import Sphinx
 from sphinx.util.logging import getLogger
 from .utils import match_url
-from .context import get_context_github
+from .context import get_context_github, prefetch_avatars, set_avatar_size
 from .. import (
     SPHINX_SOCIAL_CARDS_CONFIG_KEY,
     add_jinja_context,
@@ -122,6 +134,12 @@ def on_builder_init(app: Sphinx):
     # Use information to get a JSON payload from a REST API call
     gh_ctx = get_context_github(owner, repo)
 
+    # Download the avatars now, so they are not downloaded while rendering cards
+    card_config: Social_Cards = getattr(app.config, SPHINX_SOCIAL_CARDS_CONFIG_KEY)
+    avatar_size = getattr(app.config, "github_avatar_size")
+    set_avatar_size(gh_ctx, avatar_size)
+    prefetch_avatars(gh_ctx, card_config.cache_dir, avatar_size)
+
     # Add the fetched information to the builder environment
     add_jinja_context(app, {"github": gh_ctx})
 
@@ -129,3 +147,4 @@ def on_builder_init(app: Sphinx):
 def setup(app: Sphinx):
     app.connect("builder-inited", on_builder_init)
     app.add_config_value("repo_url", default="", rebuild="html", types=[str])
+    app.add_config_value("github_avatar_size", default=180, rebuild="html", types=[int])
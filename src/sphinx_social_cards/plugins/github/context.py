@@ -1,12 +1,20 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 import os
 from pathlib import Path
+import time
 from typing import cast, Any
-from urllib.parse import quote
+from urllib.parse import parse_qsl, quote, urlencode, urlparse, urlunparse
 
 import pydantic
+import requests
 from sphinx.util.logging import getLogger
 from .utils import reduce_big_number, strip_url_protocol, get_cache_dir
-from ...validators import try_request
+from ...cache import atomic_write, download_path, touch
+from ...fetch import Fetcher
+from ...fonts import ensure_qt_app
+from ...images import downsample_image
 
 LOGGER = getLogger(__name__)
 
@@ -17,7 +25,8 @@ OPT_STR = str | None
 class BaseUser(pydantic.BaseModel):
     #: The account's name.
     login: str = ""
-    #: The account's avatar image's URL.
+    #: The account's avatar image's URL. Avatars served by GitHub are requested in the
+    #: size set by :confval:`github_avatar_size`.
     avatar: str = ""
 
 
@@ -125,107 +134,228 @@ def get_api_token() -> dict[str, dict[str, str]]:
     return {"headers": {"Authorization": token}}
 
 
+#: The age (in seconds) of a cached response that is used without revalidation.
+MAX_AGE = 60 * 60
+#: The maximum number of pages fetched from a paginated REST API endpoint.
+MAX_PAGES = 10
+
+
+def _get(url: str, headers: dict[str, str]) -> requests.Response:
+    response = Fetcher.request(url, headers=headers)
+    retry_after = response.headers.get("Retry-After", "")
+    if response.status_code in (403, 429) and retry_after.isdigit():
+        # a secondary rate limit was hit; wait (if not too long) and try again
+        if int(retry_after) <= Fetcher.max_retry_after:
+            time.sleep(int(retry_after))
+            response = Fetcher.request(url, headers=headers)
+    if response.headers.get("X-RateLimit-Remaining", None) == "0":
+        reset = int(response.headers.get("X-RateLimit-Reset", "0"))
+        LOGGER.warning(
+            "GitHub REST API rate limit reached (resets at %s)",
+            time.strftime("%X", time.localtime(reset)),
+        )
+    return response
+
+
+def fetch_json(url: str, cache_dir: str, paginate: bool = False) -> Any:
+    """Get the JSON payload of a GitHub REST API endpoint.
+
+    Responses are cached in the ``cache_dir``. A cached response older than `MAX_AGE` is
+    revalidated using its ``ETag``, so an unchanged response is not downloaded again
+    (which does not count against the REST API rate limit). If the REST API cannot be
+    reached (or the rate limit is exceeded), then a cached response is used as is. In
+    ``offline`` `Fetcher.mode`, a cached response is always used as is.
+
+    If ``paginate`` is enabled, then the items from all pages (up to `MAX_PAGES`) are
+    returned as one `list`.
+    """
+    cache_file = Path(cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest()[:32])
+    cache_file = cache_file.with_suffix(".json")
+    cached: dict[str, Any] | None = None
+    if cache_file.exists():
+        cached = json.loads(cache_file.read_text(encoding="utf-8"))
+        assert cached is not None
+        if Fetcher.mode == "offline":
+            return cached["payload"]
+        if Fetcher.use_cache() and time.time() - cache_file.stat().st_mtime < MAX_AGE:
+            return cached["payload"]
+    headers: dict[str, str] = get_api_token().get("headers", {}).copy()
+    if cached is not None and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    first_url = f"{url}?per_page=100" if paginate else url
+    LOGGER.info("Fetching info for github context: %s", url)
+    try:
+        response = _get(first_url, headers)
+    except requests.RequestException as exc:
+        if cached is None:
+            raise RuntimeError(f"requested {url} failed: {exc}") from exc
+        LOGGER.warning("Using cached response from %s: %s", url, exc)
+        return cached["payload"]
+    if response.status_code == 304 and cached is not None:
+        touch(cache_file)
+        return cached["payload"]
+    if response.status_code != 200:
+        if cached is None:
+            raise RuntimeError(f"requested {url} returned {response.status_code}")
+        LOGGER.warning("Using cached response from %s (returned %d)", url, response.status_code)
+        return cached["payload"]
+    payload = response.json()
+    etag = response.headers.get("ETag")
+    pages = 1
+    headers.pop("If-None-Match", None)
+    while paginate and "next" in response.links and pages < MAX_PAGES:
+        response = _get(response.links["next"]["url"], headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"requested {response.url} returned {response.status_code}")
+        payload.extend(response.json())
+        pages += 1
+    atomic_write(cache_file, json.dumps({"url": url, "etag": etag, "payload": payload}).encode())
+    return payload
+
+
 def get_context_github(owner: str | None, repo: str | None) -> dict[str, Any]:
     gh_ctx = Github()
     if owner is None:
         return gh_ctx.model_dump()
     cache_dir = get_cache_dir()
-    owner_cache_name = quote(owner)
-    owner_cache_file = Path(cache_dir, owner_cache_name).with_suffix(".json")
-    request_args = get_api_token()
-    if owner_cache_file.exists():
-        gh_ctx.owner = Owner.model_validate_json(owner_cache_file.read_text(encoding="utf-8"))
-    else:
-        owner_cache_file.parent.mkdir(parents=True, exist_ok=True)
-        # get github account account info
-        LOGGER.info("Fetching info for github context about account: %s", owner)
-        res_json = try_request(f"https://api.github.com/users/{owner}", **request_args).json()
-        assert isinstance(res_json, dict)
-        gh_ctx.owner = Owner(
-            **{
-                key: res_json.get(key)
-                for key in [
-                    "login",
-                    "type",
-                    "name",
-                    "followers",
-                    "following",
-                    "bio",
-                    "blog",
-                    "email",
-                    "location",
-                    "hirable",
-                    "public_repos",
-                    "public_gists",
-                    "twitter_username",
-                ]
-                if key in res_json
+    api_urls: dict[str, tuple[str, bool]] = {
+        "owner": (f"https://api.github.com/users/{quote(owner)}", False),
+        "organizations": (f"https://api.github.com/users/{quote(owner)}/orgs", False),
+    }
+    if repo is not None:
+        repo_url = f"https://api.github.com/repos/{quote(owner)}/{quote(repo)}"
+        api_urls.update(
+            {
+                "repo": (repo_url, False),
+                "languages": (f"{repo_url}/languages", False),
+                "contributors": (f"{repo_url}/contributors", True),
+                "tags": (f"{repo_url}/tags", True),
             }
         )
-        gh_ctx.owner.avatar = res_json.get("avatar_url", "")
-        gh_ctx.owner.html_url = strip_url_protocol(res_json.get("html_url", ""))
-        if "organizations_url" in res_json:
-            response = try_request(res_json["organizations_url"], **request_args).json()
-            for org in cast(list[dict[str, str]], response):
-                gh_ctx.owner.organizations.append(
-                    Organization(
-                        login=org.get("login", ""),
-                        avatar=org.get("avatar_url", ""),
-                        description=org.get("description", ""),
-                    )
-                )
-        owner_cache_file.write_text(gh_ctx.owner.model_dump_json(indent=2), encoding="utf-8")
+    # all REST API endpoints are requested concurrently
+    with ThreadPoolExecutor(max_workers=len(api_urls)) as pool:
+        futures = {
+            key: pool.submit(fetch_json, url, cache_dir, paginate)
+            for key, (url, paginate) in api_urls.items()
+        }
+        results: dict[str, Any] = {key: future.result() for key, future in futures.items()}
+
+    res_json = cast(dict[str, Any], results["owner"])
+    gh_ctx.owner = Owner(
+        **{
+            key: res_json.get(key)
+            for key in [
+                "login",
+                "type",
+                "name",
+                "followers",
+                "following",
+                "bio",
+                "blog",
+                "email",
+                "location",
+                "hirable",
+                "public_repos",
+                "public_gists",
+                "twitter_username",
+            ]
+            if key in res_json
+        }
+    )
+    gh_ctx.owner.avatar = res_json.get("avatar_url", "")
+    gh_ctx.owner.html_url = strip_url_protocol(res_json.get("html_url", ""))
+    for org in cast(list[dict[str, str]], results["organizations"]):
+        gh_ctx.owner.organizations.append(
+            Organization(
+                login=org.get("login", ""),
+                avatar=org.get("avatar_url", ""),
+                description=org.get("description", ""),
+            )
+        )
 
     if repo is None:
         return gh_ctx.model_dump()
     # its a repo
-    repo_cache_name = quote("/".join([owner, quote(repo)]))
-    repo_cache_file = Path(cache_dir, repo_cache_name).with_suffix(".json")
-    if repo_cache_file.exists():
-        gh_ctx.repo = Repo.model_validate_json(repo_cache_file.read_text(encoding="utf-8"))
-    else:
-        repo_cache_file.parent.mkdir(parents=True, exist_ok=True)
-        LOGGER.info("Fetching info for github context about repo: %s/%s", owner, repo)
-        res_json = try_request(f"https://api.github.com/repos/{owner}/{repo}").json()
-        res_json = cast(dict[str, Any], res_json)
-        license_name = ""
-        if isinstance(res_json.get("license", None), dict):
-            license_name = res_json.get("license", {}).get("name", "")
-        gh_ctx.repo = Repo(
-            stars=reduce_big_number(res_json.get("stargazers_count", 0)),
-            watchers=reduce_big_number(res_json.get("watchers_count", 0)),
-            forks=reduce_big_number(res_json.get("forks", 0)),
-            license=license_name,
-            open_issues=reduce_big_number(res_json.get("open_issues_count", 0)),
-            topics=res_json.get("topics", []),
-            name=res_json.get("name", ""),
-            description=res_json.get("description", ""),
-            language=res_json.get("language", ""),
-            homepage=strip_url_protocol(res_json.get("homepage", "")),
-            html_url=strip_url_protocol(res_json.get("html_url", "")),
+    res_json = cast(dict[str, Any], results["repo"])
+    license_name = ""
+    if isinstance(res_json.get("license", None), dict):
+        license_name = res_json.get("license", {}).get("name", "")
+    gh_ctx.repo = Repo(
+        stars=reduce_big_number(res_json.get("stargazers_count", 0)),
+        watchers=reduce_big_number(res_json.get("watchers_count", 0)),
+        forks=reduce_big_number(res_json.get("forks", 0)),
+        license=license_name,
+        open_issues=reduce_big_number(res_json.get("open_issues_count", 0)),
+        topics=res_json.get("topics", []),
+        name=res_json.get("name", ""),
+        description=res_json.get("description", ""),
+        language=res_json.get("language", ""),
+        homepage=strip_url_protocol(res_json.get("homepage", "")),
+        html_url=strip_url_protocol(res_json.get("html_url", "")),
+    )
+    langs = cast(dict[str, float], dict(results["languages"]))
+    # convert arbitrary units to percentages
+    total = sum(list(langs.values()))
+    for lang in langs:
+        langs[lang] = round(langs[lang] / total * 100, 1)
+    gh_ctx.repo.languages = langs
+    gh_ctx.repo.contributors = [
+        Contributor(
+            login=u["login"],
+            avatar=u["avatar_url"],
+            contributions=u["contributions"],
         )
-        if "languages_url" in res_json:
-            langs = try_request(res_json["languages_url"]).json()
-            langs = cast(dict[str, float], langs)
-            # convert arbitrary units to percentages
-            total = sum(list(langs.values()))
-            for lang in langs:
-                langs[lang] = round(langs[lang] / total * 100, 1)
-            gh_ctx.repo.languages = langs
-        if "contributors_url" in res_json:
-            response = try_request(res_json["contributors_url"]).json()
-            response = cast(list[dict[str, Any]], response)
-            gh_ctx.repo.contributors = [
-                Contributor(
-                    login=u["login"],
-                    avatar=u["avatar_url"],
-                    contributions=u["contributions"],
-                )
-                for u in response
-            ]
-        if "tags_url" in res_json:
-            response = try_request(res_json["tags_url"]).json()
-            gh_ctx.repo.tags = [t["name"] for t in cast(list[dict[str, str]], response)]
-        repo_cache_file.write_text(gh_ctx.repo.model_dump_json(indent=2), encoding="utf-8")
+        for u in cast(list[dict[str, Any]], results["contributors"])
+    ]
+    gh_ctx.repo.tags = [t["name"] for t in cast(list[dict[str, str]], results["tags"])]
 
     return gh_ctx.model_dump()
+
+
+def get_avatar_urls(gh_ctx: dict[str, Any]) -> list[str]:
+    """Get the (unique) avatar URLs of the owner, organizations, and contributors in the
+    github context."""
+    owner = gh_ctx["owner"]
+    urls = [owner["avatar"]] + [org["avatar"] for org in owner["organizations"]]
+    urls.extend(contributor["avatar"] for contributor in gh_ctx["repo"]["contributors"])
+    return [url for url in dict.fromkeys(urls) if url]
+
+
+def sized_avatar_url(url: str, size: int) -> str:
+    """Get the URL of an avatar image in the given ``size`` (if served by GitHub)."""
+    url_parts = urlparse(url)
+    if not url_parts.netloc.endswith("githubusercontent.com"):
+        return url
+    query = [(key, val) for key, val in parse_qsl(url_parts.query) if key != "s"]
+    query.append(("s", str(size)))
+    return urlunparse(url_parts._replace(query=urlencode(query)))
+
+
+def set_avatar_size(gh_ctx: dict[str, Any], size: int):
+    """Replace the avatar URLs in the github context with the URLs of the avatar images
+    in the given ``size``.
+
+    This way, the layouts use the same URL that `prefetch_avatars()` downloads (and
+    the image is not downloaded again in its original size).
+    """
+    owner = gh_ctx["owner"]
+    for account in [owner, *owner["organizations"], *gh_ctx["repo"]["contributors"]]:
+        if account["avatar"]:
+            account["avatar"] = sized_avatar_url(account["avatar"], size)
+
+
+def prefetch_avatars(gh_ctx: dict[str, Any], cache_dir: str | Path, size: int):
+    """Download all avatar images in the github context concurrently.
+
+    The images are stored where `find_image()` expects downloaded images, so rendering
+    the cards does not need to download the avatars. Each image is downsampled to the
+    given ``size``. The avatar URLs should already request the ``size`` from GitHub
+    (see `set_avatar_size()`) to avoid downloading bigger images.
+    """
+    urls = get_avatar_urls(gh_ctx)
+    Fetcher.prefetch((url, download_path(cache_dir, url)) for url in urls)
+    ensure_qt_app()
+    for url in urls:
+        img_path = download_path(cache_dir, url)
+        if img_path.exists():
+            downsample_image(img_path, size)
@@ -1,8 +1,6 @@
 from pathlib import Path
-import platform
 import re
 import shutil
-import time
 from urllib.parse import urlparse
 
 from appdirs import user_cache_dir
@@ -41,15 +39,16 @@ def match_url(repo_url: str, site_url: str) -> tuple[str | None, str | None]:
 
 
 def get_cache_dir() -> str:
-    time_fmt = "%B %#d %Y" if platform.system().lower() == "windows" else "%B %-d %Y"
-    today = time.strftime(time_fmt, time.localtime())
     cache_dir = Path(
         user_cache_dir(
             "sphinx_social_cards.plugins.github",
             "2bndy5",
-            version=today,  # (1)!
+            version="api",  # (1)!
         )
     )
-    if cache_dir.parent.exists() and not cache_dir.exists():
-        shutil.rmtree(cache_dir.parent)  # purge the old cache
+    if cache_dir.parent.exists():
+        # purge old caches (which were named after the date they were created)
+        for old_cache in cache_dir.parent.iterdir():
+            if old_cache.is_dir() and old_cache != cache_dir:
+                shutil.rmtree(old_cache)
     return str(cache_dir)
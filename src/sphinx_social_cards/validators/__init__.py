@@ -1,9 +1,11 @@
 """This module contains validating dataclasses for the configurations in python"""
 
-from pathlib import Path
-from typing import cast
+from functools import lru_cache
+from pathlib import Path, PurePosixPath
+import re
+from typing import cast, Annotated, Literal
 
-from pydantic import field_validator, PrivateAttr
+from pydantic import field_validator, PrivateAttr, Field
 from pydantic_extra_types.color import Color
 import requests
 from sphinx.config import Config
@@ -15,16 +17,69 @@ from .layers import Icon, Font
 from .layout import Layout
 from .contexts import Cards_Layout_Options
 from ..colors import auto_get_fg_color, MD_COLORS
+from ..cache import download_path
+from ..encoders import ENCODERS, ImageEncoder
+from ..fetch import Fetcher, REQUEST_TIMEOUT
 
 LOGGER = getLogger(__name__)
-REQUEST_TIMEOUT = (5, 10)
 
 
 def try_request(url, timeout=REQUEST_TIMEOUT, **kwargs) -> requests.Response:
-    response = requests.get(url, timeout=timeout, **kwargs)
-    if response.status_code != 200:
-        raise RuntimeError(f"requested {url} returned {response.status_code}")
-    return response
+    """Send a GET request using the shared `Fetcher` session."""
+    return Fetcher.get(url, timeout=timeout, **kwargs)
+
+
+# Derived values that are shared by every `Social_Cards` config during a build (eg. the
+# configs of the social-card directives): the cached logo files (mapped by URL).
+_LOGO_PATHS: dict[str, str] = {}
+
+
+def clear_derived_values():
+    """Forget the derived values computed by `Social_Cards.set_defaults()`. This is done
+    at the start of each build."""
+    _LOGO_PATHS.clear()
+
+
+def _translate_glob(pattern: str) -> str:
+    """Translate a glob pattern (relative to the documentation's source) into a regular
+    expression that matches the same paths as `pathlib.Path.glob()`."""
+    segments = PurePosixPath(pattern).parts
+    regex = ""
+    for index, segment in enumerate(segments):
+        is_last = index == len(segments) - 1
+        if segment == "**":
+            # any number of directories (or any path if it is the last segment)
+            regex += ".*" if is_last else "(?:.+/)?"
+            continue
+        pos = 0
+        while pos < len(segment):
+            char = segment[pos]
+            end = segment.find("]", pos + 2) if char == "[" else -1
+            if char == "*":
+                regex += "[^/]*"
+            elif char == "?":
+                regex += "[^/]"
+            elif end != -1:
+                chars = segment[pos + 1 : end].replace("\\", "\\\\")
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                regex += f"[{chars}]"
+                pos = end
+            else:
+                regex += re.escape(char)
+            pos += 1
+        if not is_last:
+            regex += "/"
+    return regex
+
+
+@lru_cache(maxsize=None)
+def compile_globs(patterns: tuple[str, ...]) -> re.Pattern | None:
+    """Compile a sequence of glob patterns into a single regular expression (or
+    :python:`None` if there are no patterns)."""
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{_translate_glob(pattern)})" for pattern in patterns))
 
 
 class Debug(CustomBaseModel):
@@ -65,6 +120,51 @@ class Debug(CustomBaseModel):
     """
 
 
+class Output_Format(CustomBaseModel):
+    """The file format used to save the generated images.
+
+    .. code-block:: python
+        :caption: save the social cards as lossy WebP images
+
+        social_cards = {
+            "output_format": {"format": "webp", "quality": 80},
+        }
+    """
+
+    format: str = "png"
+    """The name of the image file format. Defaults to :python:`"png"`. Supported names
+    are:
+
+    - ``png``: A PNG image with 32-bit color.
+    - ``png8``: A PNG image with an 8-bit color palette. This is best suited for layouts
+      that only use a few solid colors. Images with transparent pixels are saved with
+      32-bit color.
+    - ``webp``: A WebP image.
+    - ``avif``: An AVIF image. This requires a Qt image format plugin for AVIF (which is
+      not distributed with PySide6).
+    """
+    quality: Annotated[int, Field(ge=-1, le=100)] = -1
+    """The quality (from :python:`0` to :python:`100`) used to encode the image.
+    Defaults to :python:`-1` which uses Qt's default for the chosen `format`.
+
+    For ``webp`` and ``avif`` formats, a higher value produces a bigger image with less
+    lossy compression artifacts. For ``png`` and ``png8`` formats, a lower value produces a
+    smaller (more compressed) image, but it takes longer to encode.
+    """
+
+    @field_validator("format")
+    def validate_format(cls, val: str) -> str:
+        val = val.lower()
+        if val not in ENCODERS:
+            raise ValueError(f"unsupported output format '{val}'; only {list(ENCODERS)}")
+        return val
+
+    @property
+    def encoder(self) -> ImageEncoder:
+        """The encoder registered for the `format`."""
+        return ENCODERS[self.format]
+
+
 class Social_Cards(CustomBaseModel):
     """A `dict` of configurations related to generating social media cards.
     Each attribute equates to a supported configuration option.
@@ -133,7 +233,7 @@ class Social_Cards(CustomBaseModel):
     """A set (`dict`) of options that can be accessed via the ``layout.*`` :ref:`jinja
     context <jinja-ctx>`. See `cards_layout_options <Cards_Layout_Options>` for more
     detail."""
-    cards_exclude: list[str] | set[str] = []
+    cards_exclude: list[str] = []
     """This `list` can be used to exclude certain pages from generating social cards.
     Default is an empty `list`. |glob-list|
 
@@ -156,7 +256,7 @@ class Social_Cards(CustomBaseModel):
     .. note::
         This option does not affect the :rst:dir:`social-card` directive.
     """
-    cards_include: list[str] | set[str] = []
+    cards_include: list[str] = []
     """This `list` can be used to include certain pages from `cards_exclude` `list`.
     Default is an empty `list`. |glob-list|
 
@@ -206,12 +306,47 @@ class Social_Cards(CustomBaseModel):
     path: str = "_static/social_cards"
     """This option specifies where the generated social card images will be written to.
     It's normally not necessary to change this option. Defaults to the documentation's
-    output in the subfolder '_static/social_cards'."""
+    output in the subfolder '_static/social_cards'.
+
+    A ``manifest.json`` file is also written to this path. It maps each generated image
+    (relative to the documentation's output) to the document that uses it, the image's
+    hash, size, layout, the font and image files it uses, and the context values (eg.
+    ``page.title``) that its layout accessed. Images in this path that are no longer used
+    by any document are deleted when the build is finished.
+
+    A card is only generated again if one of its inputs changed. For instance, changing
+    an option in conf.py only affects the cards whose layout accessed that option."""
     cache_dir: str | Path = "social_cards_cache"
     """The directory (relative to the conf.py file) that is used to store cached data
     for generating the social cards. By default, this will create/use a directory named
     :python:`"social_cards_cache"` located adjacent to the conf.py file.
 
+    The cached data is organized in subfolders of this path:
+
+    .. list-table::
+        :header-rows: 1
+
+        * - Subfolder
+          - Content
+          - Eviction
+        * - ``downloads``
+          - Remote images (specified by URL).
+          - After a week (or when exceeding 64 MiB).
+        * - ``fonts``
+          - Downloaded fonts.
+          - Never.
+        * - ``resized``
+          - Resized images (as used in the cards' layers).
+          - Least recently used when exceeding 128 MiB.
+        * - ``renders``
+          - Rendered cards. A card is only rendered again when its layout, the fonts or
+            images it uses, or the version of this extension has changed.
+          - Least recently used when exceeding 256 MiB.
+        * - ``.social_card_examples``
+          - Images generated by the :rst:dir:`social-card` directive's ``:dry-run:``
+            option.
+          - When the document using the directive is changed.
+
     .. tip::
         :title: Caching Fonts
 
@@ -227,6 +362,91 @@ class Social_Cards(CustomBaseModel):
             doc/social_cards_cache/**
             !docs/social_cards_cache/fonts/*
     """
+    defer_rendering: bool = False
+    """If set to :python:`True`, then the social cards are not rendered while each
+    document is read. Instead, the cards are all rendered together after all documents
+    have been read. Defaults to :python:`False`.
+
+    The generated image's file name uses a hash of the card's layout (as if `card_hash`
+    is :python:`"layout"`) instead of a hash of the rendered image. Cards that share the
+    same layout are only rendered once.
+
+    .. note::
+        This option does not affect images generated by the :rst:dir:`social-card`
+        directive's ``:dry-run:`` option (or the :rst:dir:`image-generator` directive).
+    """
+    render_workers: Annotated[int, Field(ge=0)] = 0
+    """The number of worker processes used to render the social cards. Each worker
+    process renders cards independently of the Sphinx process (and the other workers).
+    Defaults to :python:`0` which renders all cards in the Sphinx process.
+
+    Setting this option to a value greater than :python:`1` implies `defer_rendering`
+    because the cards can only be rendered in parallel after all documents have been
+    read.
+
+    .. code-block:: python
+        :caption: use all available CPU cores
+
+        import os
+
+        social_cards = {
+            "render_workers": os.cpu_count(),
+        }
+    """
+    output_format: Output_Format | str = Output_Format()
+    """The file format used to save the generated images. This can be the `format
+    <Output_Format.format>` name or an `Output_Format` object.
+
+    .. code-block:: python
+        :caption: save the social cards as PNG images with an 8-bit color palette
+
+        social_cards = {
+            "output_format": "png8",
+        }
+    """
+
+    offline: bool = False
+    """If set to :python:`True`, then the remote resources (fonts, images, and plugin
+    contexts) are only read from the resource bundle in the `cache_dir`. The build fails
+    if a resource is not in the bundle. Defaults to :python:`False`.
+
+    The resource bundle is recorded by running the following command (with the path to
+    the folder containing conf.py). This builds the documentation, so every resource
+    that the layouts need is fetched and saved in the bundle.
+
+    .. code-block:: shell
+
+        python -m sphinx_social_cards.bundle docs
+
+    .. code-block:: python
+        :caption: build the social cards without network access
+
+        social_cards = {
+            "offline": True,
+        }
+    """
+    card_hash: Literal["pixels", "layout"] = "pixels"
+    """The hash used to name the generated images. Defaults to :python:`"pixels"`.
+
+    - ``pixels``: A hash of the rendered image's pixels. The card must be rendered to
+      know its name.
+    - ``layout``: A hash of the card's validated layout, the content of the fonts and
+      images it uses, and this extension's version. The card's name is known before it
+      is rendered, so a card that already exists in the build output is not rendered
+      again. This hash does not depend on the font rasterization, so it is the same
+      on every machine that builds the docs with the same version of this extension.
+
+    .. code-block:: python
+        :caption: name the social cards after their layout
+
+        social_cards = {
+            "card_hash": "layout",
+        }
+
+    .. note::
+        When the cards' rendering is deferred (see `defer_rendering`), the cards are
+        always named after their layout.
+    """
 
     @field_validator("debug")
     def validate_debug(cls, val: bool | Debug) -> Debug:
@@ -234,6 +454,37 @@ class Social_Cards(CustomBaseModel):
             return Debug(enable=val)
         return val
 
+    @field_validator("output_format")
+    def validate_output_format(cls, val: str | Output_Format) -> Output_Format:
+        if isinstance(val, str):
+            return Output_Format(format=val)
+        return val
+
+    @property
+    def deferred(self) -> bool:
+        """Are the social cards rendered after all documents have been read?"""
+        return self.defer_rendering or self.render_workers > 1
+
+    @property
+    def hash_layout(self) -> bool:
+        """Are the social cards named after their layout (instead of their pixels)?"""
+        return self.card_hash == "layout" or self.deferred
+
+    def generates_card(self, doc_path: str | Path) -> bool:
+        """Should a social card be generated for the given document? The ``doc_path``
+        is relative to the documentation's source (including the file suffix).
+
+        The `cards_exclude` and `cards_include` patterns are matched against the
+        ``doc_path`` (instead of the files in the documentation's source)."""
+        doc_uri = Path(doc_path).as_posix()
+        included = compile_globs(tuple(self.cards_include))
+        if included is not None and included.fullmatch(doc_uri):
+            return True
+        if not self.enable:
+            return False
+        excluded = compile_globs(tuple(self.cards_exclude))
+        return excluded is None or not excluded.fullmatch(doc_uri)
+
     def get_fonts(self) -> list[Font]:
         assert self.cards_layout_options.font is not None
         fonts: list[Font] = [self.cards_layout_options.font]
@@ -266,19 +517,6 @@ class Social_Cards(CustomBaseModel):
         cache_dir.mkdir(parents=True, exist_ok=True)
         self.cache_dir = cache_dir
 
-        excluded: set[str] = set()
-        for pattern in self.cards_exclude:
-            for match in Path(doc_src).glob(pattern):
-                rel_uri = match.relative_to(doc_src).as_posix()
-                excluded.add(rel_uri)
-        self.cards_exclude = excluded
-        included: set[str] = set()
-        for pattern in self.cards_include:
-            for match in Path(doc_src).glob(pattern):
-                rel_uri = match.relative_to(doc_src).as_posix()
-                included.add(rel_uri)
-        self.cards_include = included
-
     def _set_default_logo(self, config: Config, theme_options: dict):
         theme_icon: dict[str, str] | None = theme_options.get("icon", None)
         theme_logo: str | None = None
@@ -291,11 +529,15 @@ class Social_Cards(CustomBaseModel):
         if self.cards_layout_options.logo.image is not None and isurl(
             self.cards_layout_options.logo.image
         ):
-            response = try_request(self.cards_layout_options.logo.image)
-            f_name = Path(self.cards_layout_options.logo.image).name
-            cache_logo = Path(self.cache_dir, f_name)
-            cache_logo.write_bytes(response.content)
-            self.cards_layout_options.logo.image = str(cache_logo)
+            logo_url = self.cards_layout_options.logo.image
+            if logo_url not in _LOGO_PATHS:
+                cache_logo = Fetcher.download(logo_url, download_path(self.cache_dir, logo_url))
+                _LOGO_PATHS[logo_url] = str(cache_logo)
+                # older versions saved the logo directly in the cache_dir
+                legacy_logo = Path(self.cache_dir, Path(logo_url).name)
+                if legacy_logo.is_file():
+                    legacy_logo.unlink()
+            self.cards_layout_options.logo.image = _LOGO_PATHS[logo_url]
 
     def _set_default_colors(self, theme_options: dict):
         color = self.cards_layout_options.background_color
@@ -0,0 +1,85 @@
+import os
+from pathlib import Path
+import time
+import pytest
+from sphinx_social_cards.cache import (
+    CACHE_NAMESPACES,
+    CacheNamespace,
+    LRUCache,
+    atomic_write,
+    cache_path,
+    evict,
+    install_card,
+    remove_legacy_files,
+)
+
+
+def test_install_card(tmp_path: Path):
+    src = tmp_path / "cache" / "card.png"
+    atomic_write(src, b"card")
+    assert src.read_bytes() == b"card"
+
+    dest = tmp_path / "out" / "index-0123.png"
+    assert install_card(src, dest)
+    assert dest.read_bytes() == b"card"
+    # an existing card of the same size is not written again
+    mtime = dest.stat().st_mtime_ns
+    assert not install_card(src, dest)
+    assert dest.stat().st_mtime_ns == mtime
+    # a truncated card is replaced
+    dest.write_bytes(b"ca")
+    assert install_card(src, dest)
+    assert dest.read_bytes() == b"card"
+    # no temporary files are left behind
+    assert [p.name for p in dest.parent.iterdir()] == [dest.name]
+
+
+def test_evict(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setitem(CACHE_NAMESPACES, "renders", CacheNamespace("renders", 60, 6))
+    root = cache_path(tmp_path, "renders")
+    now = time.time()
+    for name, age in [("old", 120), ("lru", 30), ("new", 0)]:
+        for suffix in (".png", ".json"):
+            atomic_write(root / f"{name}{suffix}", b"12")
+            os.utime(root / f"{name}{suffix}", (now - age, now - age))
+    # "old" is expired and "lru" exceeds the size limit (4 bytes per entry)
+    assert evict(tmp_path, "renders") == 2
+    assert sorted(p.name for p in root.iterdir()) == ["new.json", "new.png"]
+
+    # namespaces without a policy are never evicted
+    fonts = cache_path(tmp_path, "fonts")
+    atomic_write(fonts / "Roboto.ttf", b"font")
+    os.utime(fonts / "Roboto.ttf", (0, 0))
+    assert evict(tmp_path, "fonts") == 0
+    assert (fonts / "Roboto.ttf").exists()
+
+    # the entries of kept files are not evicted (even if expired)
+    os.utime(root / "new.png", (0, 0))
+    os.utime(root / "new.json", (0, 0))
+    assert evict(tmp_path, "renders", keep=[root / "new.png"]) == 0
+    assert (root / "new.png").exists()
+
+
+def test_remove_legacy_files(tmp_path: Path):
+    for name in ("resized.png", "%2Fimages%2Flogo.svg", "conf.py"):
+        (tmp_path / name).write_bytes(b"")
+    cache_path(tmp_path, "downloads").mkdir()
+    assert remove_legacy_files(tmp_path) == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["conf.py", "downloads"]
+
+
+def test_lru_cache():
+    lru: LRUCache[str, bytes] = LRUCache(weigh=len)
+    lru.put("a", b"12")
+    lru.put("b", b"345")
+    assert lru.get("a") == b"12"  # "b" is now the least recently used
+    lru.put("c", b"6")
+    assert lru.weight == 6
+    assert lru.evict(max_weight=4) == [b"345"]
+    assert "b" not in lru and len(lru) == 2
+    assert lru.evict(max_entries=1) == [b"12"]
+    # the most recently used item is kept (unless there is no room for any item)
+    lru.put("d", b"789")
+    assert lru.evict(max_weight=1) == [b"6"]
+    assert lru.evict(max_entries=0) == [b"789"]
+    assert lru.weight == 0
@@ -1,12 +1,25 @@
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
 import os
 from pathlib import Path
 import platform
 import sys
+import threading
+import time
 import pytest
 from sphinx import version_info as sphinx_version
 from sphinx.testing.util import SphinxTestApp
 from sphinx.errors import ExtensionError
+from sphinx_social_cards.fetch import Fetcher
 from sphinx_social_cards.plugins import add_images_dir
+from sphinx_social_cards.plugins.github.context import (
+    MAX_AGE,
+    fetch_json,
+    get_avatar_urls,
+    set_avatar_size,
+    sized_avatar_url,
+)
 from sphinx_social_cards.plugins.github.utils import (
     reduce_big_number,
     strip_url_protocol,
@@ -21,6 +34,79 @@ def test_big_number():
     assert reduce_big_number(1048576) == "1M"
 
 
+def test_github_fetch_json(tmp_path: Path):
+    requests: list[str] = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            page = 2 if self.path.endswith("page=2") else 1
+            body = json.dumps([{"name": f"v{page}.0"}]).encode()
+            self.send_response(200)
+            self.send_header("ETag", '"v1"')
+            if page == 1:
+                self.send_header("Link", f'<{base_url}/tags?page=2>; rel="next"')
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        url = f"{base_url}/tags"
+        expected = [{"name": "v1.0"}, {"name": "v2.0"}]
+        assert fetch_json(url, str(tmp_path), paginate=True) == expected
+        assert requests == ["/tags?per_page=100", "/tags?page=2"]
+        # a fresh response is reused
+        assert fetch_json(url, str(tmp_path), paginate=True) == expected
+        assert len(requests) == 2
+        # a stale response is revalidated
+        for cached in tmp_path.glob("*.json"):
+            os.utime(cached, (0, 0))
+        assert fetch_json(url, str(tmp_path), paginate=True) == expected
+        assert len(requests) == 3
+    finally:
+        httpd.shutdown()
+
+
+def test_github_fetch_json_offline(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    url = "https://api.github.com/users/x"
+    cache_file = Path(tmp_path, hashlib.sha256(url.encode("utf-8")).hexdigest()[:32])
+    cache_file = cache_file.with_suffix(".json")
+    cache_file.write_text(
+        json.dumps({"url": url, "etag": None, "payload": {"login": "x"}}), encoding="utf-8"
+    )
+    stale = time.time() - MAX_AGE * 2
+    os.utime(cache_file, (stale, stale))
+    monkeypatch.setattr(Fetcher, "mode", "offline")
+    monkeypatch.setattr(Fetcher, "bundle", None)
+    # a stale response is used as is (instead of requiring it in the resource bundle)
+    assert fetch_json(url, str(tmp_path)) == {"login": "x"}
+
+
+def test_avatar_urls():
+    avatar = "https://avatars.githubusercontent.com/u/14963867?v=4"
+    gh_ctx = {
+        "owner": {"avatar": avatar, "organizations": [{"avatar": ""}]},
+        "repo": {"contributors": [{"avatar": avatar}, {"avatar": "https://example.com/a.png"}]},
+    }
+    assert get_avatar_urls(gh_ctx) == [avatar, "https://example.com/a.png"]
+    assert sized_avatar_url(avatar, 180) == f"{avatar}&s=180"
+    assert sized_avatar_url(f"{avatar}&s=40", 180) == f"{avatar}&s=180"
+    assert sized_avatar_url("https://example.com/a.png", 180) == "https://example.com/a.png"
+    # the context uses the same URLs that are downloaded
+    set_avatar_size(gh_ctx, 180)
+    assert get_avatar_urls(gh_ctx) == [f"{avatar}&s=180", "https://example.com/a.png"]
+
+
 @pytest.mark.parametrize(
     "url_key,url",
     (
@@ -0,0 +1,132 @@
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import os
+from pathlib import Path
+import shutil
+import threading
+import time
+from typing import Generator
+import pytest
+from sphinx.testing.util import SphinxTestApp
+from urllib3 import HTTPResponse
+from urllib3.util.retry import RequestHistory
+from sphinx_social_cards.bundle import ResourceBundle
+from sphinx_social_cards.cache import download_path
+from sphinx_social_cards.fetch import Fetcher
+
+
+@pytest.fixture
+def server(tmp_path: Path) -> Generator[tuple[str, list[str]], None, None]:
+    served = tmp_path / "served"
+    served.mkdir()
+    (served / "logo.png").write_bytes(b"logo")
+    requests: list[str] = []
+
+    class Handler(SimpleHTTPRequestHandler):
+        def log_message(self, format, *args):
+            requests.append(f"{self.command} {self.path} {args[1]}")
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), partial(Handler, directory=str(served)))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", requests
+    httpd.shutdown()
+
+
+def test_download(server: tuple[str, list[str]], tmp_path: Path):
+    base_url, requests = server
+    file_path = tmp_path / "downloads" / "logo.png"
+    Fetcher.download(f"{base_url}/logo.png", file_path)
+    assert file_path.read_bytes() == b"logo"
+    assert file_path.with_name("logo.png.json").exists()
+
+    # a recent download is not requested again
+    Fetcher.download(f"{base_url}/logo.png", file_path)
+    assert len(requests) == 1
+
+    # an older download is revalidated
+    os.utime(file_path, (0, 0))
+    Fetcher.download(f"{base_url}/logo.png", file_path)
+    assert requests[-1].endswith("304")
+    assert file_path.stat().st_mtime > 0
+
+    # many files are downloaded concurrently
+    Fetcher.prefetch(
+        (f"{base_url}/logo.png?{i}", tmp_path / "downloads" / f"logo{i}.png") for i in range(4)
+    )
+    assert len(list(tmp_path.glob("downloads/logo?.png"))) == 4
+
+
+def test_retry_delay():
+    retry = Fetcher.session().get_adapter("https://").max_retries
+    # a long delay requested by the server is not honored
+    response = HTTPResponse(headers={"Retry-After": "3600"}, status=503)
+    assert retry.get_retry_after(response) == Fetcher.max_retry_after
+    # the exponential backoff is also bounded
+    failed = RequestHistory("GET", "https://example.com", None, 503, None)
+    retry = retry.new(history=(failed,) * 12)
+    assert retry.get_backoff_time() == Fetcher.max_retry_after
+
+
+def test_offline_bundle(
+    server: tuple[str, list[str]], tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    base_url, requests = server
+    monkeypatch.setattr(Fetcher, "bundle", ResourceBundle(tmp_path / "cache"))
+    monkeypatch.setattr(Fetcher, "_recorded", set())
+
+    # resources are saved in the bundle while recording (and only requested once)
+    monkeypatch.setattr(Fetcher, "mode", "record")
+    assert Fetcher.get(f"{base_url}/logo.png").content == b"logo"
+    assert Fetcher.get(f"{base_url}/logo.png").content == b"logo"
+    assert len(requests) == 1
+
+    # resources are read from the bundle when offline
+    monkeypatch.setattr(Fetcher, "mode", "offline")
+    file_path = tmp_path / "downloads" / "logo.png"
+    Fetcher.download(f"{base_url}/logo.png", file_path)
+    assert file_path.read_bytes() == b"logo"
+    assert len(requests) == 1
+    with pytest.raises(RuntimeError, match="not in the offline resource bundle"):
+        Fetcher.get(f"{base_url}/missing.png")
+
+
+def test_offline_render_workers(
+    server: tuple[str, list[str]],
+    sphinx_make_app,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    base_url, requests = server
+    # the build changes the Fetcher's state
+    monkeypatch.setattr(Fetcher, "mode", Fetcher.mode)
+    monkeypatch.setattr(Fetcher, "bundle", Fetcher.bundle)
+    url = f"{base_url}/rainbow.png"
+    shutil.copyfile(Path(__file__).parent / "rainbow.png", tmp_path / "served" / "rainbow.png")
+    # an outdated download is never revalidated while offline (not even by the workers)
+    downloaded = download_path(tmp_path / "social_cards_cache", url)
+    downloaded.parent.mkdir(parents=True)
+    shutil.copyfile(Path(__file__).parent / "rainbow.png", downloaded)
+    outdated = time.time() - Fetcher.revalidate_after * 2
+    os.utime(downloaded, (outdated, outdated))
+    (tmp_path / "layouts").mkdir()
+    (tmp_path / "layouts" / "remote.yml").write_text(
+        f"layers:\n  - background: {{ image: '{url}' }}\n"
+        "  - typography: { content: '{{ page.title }}' }\n",
+        encoding="utf-8",
+    )
+    app: SphinxTestApp = sphinx_make_app(
+        extra_conf='social_cards["cards_layout_dir"] = ["layouts"]\n'
+        'social_cards["cards_layout"] = "remote"\n'
+        'social_cards["offline"] = True\n'
+        'social_cards["defer_rendering"] = True\n'
+        'social_cards["render_workers"] = 2\n',
+        files={
+            "index.rst": "\nTest Title\n==========\n",
+            "other.rst": "\n:orphan:\n\nOther Title\n===========\n",
+        },
+    )
+    app.build()
+    assert not app._warning.getvalue()
+    assert len(list(Path(app.outdir, "_static", "social_cards").glob("*-*.png"))) == 2
+    assert not requests
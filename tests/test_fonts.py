@@ -1,7 +1,11 @@
+import json
+from pathlib import Path
+
+from PySide6.QtGui import QFontDatabase
 import pytest
 from sphinx.testing.util import SphinxTestApp
 from sphinx_social_cards.validators.layers import Font
-from sphinx_social_cards.fonts import FontSourceManager
+from sphinx_social_cards.fonts import FontSourceManager, FontRegistry, ensure_qt_app
 
 
 @pytest.mark.parametrize("style", ["normal", pytest.param("bold", marks=pytest.mark.xfail)])
@@ -43,3 +47,60 @@ A Really Long Test Title That Overflows 2 Lines
 @pytest.mark.xfail
 def test_invalid_family() -> None:
     FontSourceManager.get_font(Font(family="X"))
+
+
+def test_font_registry() -> None:
+    ensure_qt_app()
+    fonts = [Font(weight=400), Font(weight=700)]
+    for font in fonts:
+        FontSourceManager.get_font(font)
+    assert fonts[0].path is not None and fonts[1].path is not None
+    regular = FontRegistry.get(fonts[0].path)
+    assert FontRegistry.get(fonts[0].path) is regular
+    bold = FontRegistry.get(fonts[1].path)
+    assert regular.family == bold.family
+    assert regular.style != bold.style
+
+    # only the most recently used font is kept when the cap is exceeded
+    FontRegistry.clear()
+    FontRegistry.max_bytes = 1
+    try:
+        FontRegistry.get(fonts[0].path)
+        bold = FontRegistry.get(fonts[1].path)
+        assert QFontDatabase.styles(bold.family) == [bold.style]
+    finally:
+        FontRegistry.max_bytes = None
+        FontRegistry.clear()
+
+
+def test_font_index(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    info = {
+        "id": "foo",
+        "family": "Foo",
+        "subsets": ["latin"],
+        "weights": [400, 700],
+        "styles": ["normal"],
+        "defSubset": "latin",
+        "variants": {},
+    }
+    (tmp_path / "Foo.json").write_text(json.dumps(info), encoding="utf-8")
+    (tmp_path / "Foo normal (latin 700).ttf").write_bytes(b"")
+    monkeypatch.setattr(FontSourceManager, "cache_path", tmp_path)
+
+    font = Font(family="Foo", weight=600)
+    FontSourceManager.get_font(font)
+    assert font.path == str(tmp_path / "Foo normal (latin 700).ttf")
+    assert font.subset == "latin" and font.weight == 700
+    # cached families are indexed without their variants
+    index = json.loads((tmp_path / FontSourceManager.index_name).read_text(encoding="utf-8"))
+    assert list(index) == ["Foo"] and "variants" not in index["Foo"]
+
+    # a resolved font does not touch the file system again
+    def fail(*args, **kwargs):
+        raise AssertionError("unexpected file system access")
+
+    monkeypatch.setattr(Path, "read_text", fail)
+    monkeypatch.setattr(Path, "exists", fail)
+    again = Font(family="Foo", weight=600)
+    FontSourceManager.get_font(again)
+    assert again.path == font.path and again.weight == 700
@@ -1,6 +1,20 @@
 from pathlib import Path
+import shutil
+from PySide6.QtGui import QFontMetricsF, QImage, QPainter
 import pytest
 from sphinx.testing.util import SphinxTestApp
+from sphinx_social_cards.atlas import LayerAtlas
+from sphinx_social_cards.fonts import FontRegistry, FontSourceManager, ensure_qt_app
+from sphinx_social_cards.generator import (
+    CardGenerator,
+    _CanvasPool,
+    _DEFAULT_LAYOUT_DIR,
+    _get_jinja_env,
+    _get_layout_template,
+    _load_layout,
+)
+from sphinx_social_cards.validators.layers import Font, Typography
+from sphinx_social_cards.validators.layout import Layer
 
 TEST_LAYOUT = str(Path(__file__).parent / "layouts").replace("\\", "\\\\")
 
@@ -39,6 +53,20 @@ Test Title
     assert not app._warning.getvalue()
 
 
+def test_layout_template_cache(tmp_path: Path):
+    search_path = (str(tmp_path), str(_DEFAULT_LAYOUT_DIR))
+    template = _get_layout_template(search_path, "default")
+    assert template.environment is _get_jinja_env(search_path)
+    assert _get_layout_template(search_path, "default") is template
+    # a layout is found again if its file changes extension
+    Path(tmp_path, "custom.yml").write_text("layers: []", encoding="utf-8")
+    assert str(_get_layout_template(search_path, "custom").filename).endswith("custom.yml")
+    Path(tmp_path, "custom.yml").rename(Path(tmp_path, "custom.yaml"))
+    assert str(_get_layout_template(search_path, "custom").filename).endswith("custom.yaml")
+    with pytest.raises(ValueError):
+        _get_layout_template(search_path, "non-existent")
+
+
 @pytest.mark.parametrize("radius", [0, 315, 600])
 @pytest.mark.parametrize(
     "corners",
@@ -140,6 +168,24 @@ Test Title
     assert not app._warning.getvalue()
 
 
+@pytest.mark.parametrize("line_height", [0.5, 1, 1.25])
+@pytest.mark.parametrize("line_amt", [1, 2, 5])
+def test_calc_font_size(line_amt: int, line_height: float) -> None:
+    ensure_qt_app()
+    font = Font()
+    FontSourceManager.get_font(font)
+    assert font.path is not None
+    font_db_info = FontRegistry.get(font.path)
+    typo_font = CardGenerator.calc_font_size(line_amt, line_height, 210, font_db_info)
+    theoretical_height = 210 / line_amt
+    space = (theoretical_height - theoretical_height * line_height) * max(1, line_amt - 1)
+    target = theoretical_height - space / line_amt
+    assert typo_font.pointSize() % 2 == 0
+    assert QFontMetricsF(typo_font).height() >= target - 1
+    smaller = CardGenerator.calc_font_size(line_amt, line_height, 210 - 20, font_db_info)
+    assert smaller.pointSize() <= typo_font.pointSize()
+
+
 @pytest.mark.parametrize(
     "content",
     [
@@ -173,6 +219,67 @@ Test Title
     assert not app._warning.getvalue()
 
 
+@pytest.mark.parametrize("overflow", [True, False], ids=["on", "off"])
+def test_make_text_block(overflow: bool) -> None:
+    ensure_qt_app()
+    typography = Typography(
+        content="sphinx_social_cards.generator.CardGenerator.make_text_block " * 4,
+        line={"amount": 1},
+        overflow=overflow,
+    )
+    layer = Layer(size={"width": 400, "height": 200}, typography=typography)
+    font = Font()
+    FontSourceManager.get_font(font)
+    assert font.path is not None
+    img = QImage(400, 200, QImage.Format.Format_ARGB32)
+    canvas = QPainter(img)
+    try:
+        factory = CardGenerator.__new__(CardGenerator)
+        lines, _, _, line_amt = factory.make_text_block(
+            typography, layer, canvas, FontRegistry.get(font.path)
+        )
+        metrics = QFontMetricsF(canvas.font())
+    finally:
+        canvas.end()
+    assert typography.line.amount == 1  # the validated model is not changed
+    assert len(lines) == line_amt
+    if overflow:
+        assert line_amt > 1
+        assert "".join(lines).replace(" ", "") == typography.content.replace(" ", "")
+        assert all(metrics.boundingRect(line).right() < 400 for line in lines)
+    else:
+        assert line_amt == 1
+        assert lines[0].endswith("…")
+
+
+def test_layer_atlas(sphinx_make_app, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    pages = {
+        f"{name}.rst": f":orphan:\n\n{name.title()}\n{'=' * len(name)}\n"
+        for name in ("first", "second", "third")
+    }
+    app: SphinxTestApp = sphinx_make_app(files={"index.rst": "Test Title\n==========\n", **pages})
+    out_dir = Path(app.outdir, "_static", "social_cards")
+
+    LayerAtlas.clear()
+    app.build()
+    assert not app._warning.getvalue()
+    assert LayerAtlas._composites  # the leading layers are shared by all pages
+    cards = {p.name: p.read_bytes() for p in out_dir.glob("*.png")}
+    assert len(cards) == 4
+
+    # cards rendered without the atlas should be identical
+    LayerAtlas.clear()
+    monkeypatch.setattr(LayerAtlas, "max_entries", 0)
+    shutil.rmtree(tmp_path / "social_cards_cache" / "renders")
+    shutil.rmtree(out_dir)
+    for src in tmp_path.glob("*.rst"):  # the cards are made when the documents are read
+        src.touch()
+    app.build()
+    assert not app._warning.getvalue()
+    assert not LayerAtlas._composites
+    assert {p.name: p.read_bytes() for p in out_dir.glob("*.png")} == cards
+
+
 TEST_AREA = "{ width: 100, height: 100 }"
 
 
@@ -214,6 +321,35 @@ Test Title
     assert not app._warning.getvalue()
 
 
+def test_canvas_pool():
+    ensure_qt_app()
+    with _CanvasPool.borrow(10, 20) as canvas:
+        assert canvas.size().toTuple() == (10, 20)
+        assert canvas.pixelColor(0, 0).alpha() == 0
+        canvas.fill(0xFFFFFFFF)
+        with _CanvasPool.borrow(10, 20) as other:
+            assert other is not canvas
+    with _CanvasPool.borrow(10, 20) as reused:
+        assert reused is canvas
+        assert reused.pixelColor(0, 0).alpha() == 0  # borrowed canvases are transparent
+
+
+def test_layout_cache(monkeypatch: pytest.MonkeyPatch):
+    layout_yaml = "size: { width: 100, height: 50 }\nlayers:\n  - background: { color: red }\n"
+    layout = _load_layout(layout_yaml)
+    assert layout.size.width == 100 and len(layout.layers) == 1
+
+    # the same YAML is not validated again, and each copy can be modified independently
+    def fail(*args, **kwargs):
+        raise AssertionError("cached layout was validated again")
+
+    monkeypatch.setattr("sphinx_social_cards.generator.layout_validator.validate_python", fail)
+    layout.layers[0].size = layout.size
+    again = _load_layout(layout_yaml)
+    assert again is not layout
+    assert again.layers[0].size is None
+
+
 @pytest.mark.parametrize("layer_attr", ["icon", "background"])
 @pytest.mark.parametrize(
     "image,color",
@@ -1,10 +1,18 @@
 from pathlib import Path
+import shutil
 from typing import Literal
 
 from sphinx.testing.util import SphinxTestApp
-from PySide6.QtGui import QImage
+from PySide6.QtCore import Qt
+from PySide6.QtGui import QColor, QImage
 import pytest
-from sphinx_social_cards.images import resize_image, get_embedded_svg
+from sphinx_social_cards.images import (
+    ImageCache,
+    downsample_image,
+    resize_image,
+    get_embedded_svg,
+    overlay_color,
+)
 from sphinx_social_cards.validators.layout import Size
 
 
@@ -51,6 +59,38 @@ def test_resize_image(
         assert result.height() == size.height
 
 
+def test_image_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    ImageCache.clear()
+    img_path = Path(__file__).parent / "rainbow.png"
+    size = Size(width=100, height=100)
+    expected = resize_image(img_path, size, True).convertToFormat(
+        QImage.Format.Format_ARGB32_Premultiplied
+    )
+    result = ImageCache.get(img_path, size, True, cache_dir=tmp_path)
+    assert result == expected
+    # modifying the result does not affect the cached image
+    result.fill(Qt.GlobalColor.black)
+    assert ImageCache.get(img_path, size, True, cache_dir=tmp_path) == expected
+
+    color = QColor("red")
+    tinted = ImageCache.get(img_path, size, True, color, cache_dir=tmp_path)
+    assert tinted != expected
+    assert tinted == overlay_color(resize_image(img_path, size, True), color, mask=True)
+    resized = list(Path(tmp_path, "resized").glob("*.png"))
+    assert len(resized) == 2
+
+    # images are loaded from the cache_dir when not in memory
+    ImageCache.clear()
+    monkeypatch.setattr(ImageCache, "max_bytes", 1)
+    assert ImageCache.get(img_path, size, True, cache_dir=tmp_path) == expected
+    assert ImageCache.get(img_path, size, True, color, cache_dir=tmp_path) == tinted
+    assert len(ImageCache._images) == 1  # only the most recently used image is kept
+    assert [p.stat().st_mtime_ns for p in resized] == [
+        p.stat().st_mtime_ns for p in Path(tmp_path, "resized").glob("*.png")
+    ]
+    ImageCache.clear()
+
+
 def test_icon_gradient_overlay(sphinx_make_app) -> None:
     app: SphinxTestApp = sphinx_make_app(
         files={
@@ -75,3 +115,15 @@ Test Title
 
     app.build()
     assert not app._warning.getvalue()
+
+
+def test_downsample_image(tmp_path: Path):
+    img_path = tmp_path / "avatar"
+    shutil.copyfile(Path(__file__).parent.parent / "docs" / "images" / "avatar.jpg", img_path)
+    size = QImage(str(img_path)).size()
+    max_size = max(size.width(), size.height()) // 2
+    assert downsample_image(img_path, max_size)
+    shrunk = QImage(str(img_path))
+    assert max(shrunk.width(), shrunk.height()) == max_size
+    # an image that is small enough is not changed
+    assert not downsample_image(img_path, max_size)
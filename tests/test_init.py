@@ -1,4 +1,6 @@
+import json
 from pathlib import Path
+import shutil
 import pytest
 from sphinx.testing.util import SphinxTestApp
 
@@ -130,3 +132,239 @@ Test Title
     app._status.flush()
     app.build(True)
     # print(app._status.getvalue())
+
+
+def test_render_cache(sphinx_make_app, tmp_path: Path):
+    app: SphinxTestApp = sphinx_make_app(
+        files={
+            "index.rst": """
+Test Title
+==========
+"""
+        },
+    )
+
+    app.build()
+    assert not app._warning.getvalue()
+    renders = tmp_path / "social_cards_cache" / "renders"
+    cached = list(renders.glob("*.png"))
+    assert len(cached) == 1
+    assert cached[0].with_suffix(".json").exists()
+    cards = list(Path(app.outdir, "_static", "social_cards").glob("*.png"))
+    assert len(cards) == 1
+    assert cards[0].read_bytes() == cached[0].read_bytes()
+
+    # a full rebuild should reuse the cached card
+    mtime = cached[0].stat().st_mtime_ns
+    app.build(True)
+    assert not app._warning.getvalue()
+    assert cached[0].stat().st_mtime_ns == mtime
+
+
+@pytest.mark.parametrize("workers", [0, 2], ids=["in-process", "worker-pool"])
+@pytest.mark.parametrize("via_directive", [True, False], ids=["directive", "transform"])
+def test_defer_rendering(sphinx_make_app, via_directive: bool, workers: int):
+    app: SphinxTestApp = sphinx_make_app(
+        extra_conf=f"""
+social_cards["defer_rendering"] = True
+social_cards["render_workers"] = {workers}
+""",
+        files={
+            "index.rst": f"""
+Test Title
+==========
+
+{".. social-card::" if via_directive else ""}
+""",
+            "other.rst": """
+:orphan:
+
+Other Title
+===========
+""",
+        },
+    )
+
+    app.build()
+    assert not app._warning.getvalue()
+    for doc in ("index", "other"):
+        cards = list(Path(app.outdir, "_static", "social_cards").glob(f"{doc}-*.png"))
+        assert len(cards) == 1
+        assert cards[0].name in Path(app.outdir, f"{doc}.html").read_text(encoding="utf-8")
+
+
+def test_card_hash_layout(sphinx_make_app, make_app, tmp_path: Path):
+    files = {"index.rst": "\nTest Title\n==========\n"}
+    app: SphinxTestApp = sphinx_make_app(
+        extra_conf='social_cards["card_hash"] = "layout"\n', files=files
+    )
+    app.build()
+    assert not app._warning.getvalue()
+    cards = list(Path(app.outdir, "_static", "social_cards").glob("index-*.png"))
+    assert len(cards) == 1
+    assert cards[0].name in Path(app.outdir, "index.html").read_text(encoding="utf-8")
+
+    # the existing card is not rendered (or copied) again
+    mtime = cards[0].stat().st_mtime_ns
+    shutil.rmtree(tmp_path / "social_cards_cache" / "renders")
+    app.build(True)
+    assert not app._warning.getvalue()
+    assert cards[0].stat().st_mtime_ns == mtime
+    assert not (tmp_path / "social_cards_cache" / "renders").exists()
+
+    # the card's name does not depend on where the project is located
+    moved = tmp_path.parent / f"{tmp_path.name}-moved"
+    shutil.copytree(tmp_path, moved, ignore=shutil.ignore_patterns("_build"))
+    moved_app: SphinxTestApp = make_app(srcdir=type(app.srcdir)(str(moved)))
+    moved_app.build()
+    assert Path(moved_app.outdir, "_static", "social_cards", cards[0].name).exists()
+
+
+def test_prune_stale_cards(sphinx_make_app, tmp_path: Path):
+    app: SphinxTestApp = sphinx_make_app(files={"index.rst": "\nTest Title\n==========\n"})
+    app.build()
+    assert not app._warning.getvalue()
+    card_dir = Path(app.outdir, "_static", "social_cards")
+    old_cards = list(card_dir.glob("index-*.png"))
+    assert len(old_cards) == 1
+
+    # changing the page's title changes its card
+    (tmp_path / "index.rst").write_text("\nNew Title\n=========\n", encoding="utf-8")
+    app.build()
+    assert not app._warning.getvalue()
+    cards = list(card_dir.glob("index-*.png"))
+    assert len(cards) == 1
+    assert cards[0] != old_cards[0]
+
+    manifest = json.loads((card_dir / "manifest.json").read_text(encoding="utf-8"))
+    record = manifest[f"_static/social_cards/{cards[0].name}"]
+    assert record["docname"] == "index"
+    assert record["size"] == cards[0].stat().st_size
+    assert record["layout"] == "default"
+    assert record["resources"]
+
+
+def test_directive_config_cache(sphinx_make_app):
+    from sphinx_social_cards import _DIRECTIVE_CONFIGS
+
+    directive = '\n.. social-card:: {"debug": %s}\n    :dry-run:\n'
+    app: SphinxTestApp = sphinx_make_app(
+        files={
+            "index.rst": "\nTest Title\n==========\n"
+            + directive % "true"
+            + directive % "true"
+            + directive % "false"
+        }
+    )
+    app.build()
+    assert not app._warning.getvalue()
+    # directives with the same config overrides share a validated config
+    assert len(_DIRECTIVE_CONFIGS) == 2
+
+
+def test_card_dependencies(sphinx_make_app, make_app, tmp_path: Path):
+    app: SphinxTestApp = sphinx_make_app(files={"index.rst": "\nTest Title\n==========\n"})
+    app.build()
+    assert not app._warning.getvalue()
+    card_dir = Path(app.outdir, "_static", "social_cards")
+    card = next(card_dir.glob("index-*.png"))
+    manifest = json.loads((card_dir / "manifest.json").read_text(encoding="utf-8"))
+    context = manifest[f"_static/social_cards/{card.name}"]["context"]
+    assert "page.title" in context and "config.docstitle" in context
+    assert "config.author" not in context and "layout.accent" not in context
+
+    # the card is reused when its document changes (but not its inputs)
+    mtime = card.stat().st_mtime_ns
+    shutil.rmtree(tmp_path / "social_cards_cache" / "renders")
+    (tmp_path / "index.rst").write_text("\nTest Title\n==========\n\nBody\n", encoding="utf-8")
+    app.build()
+    assert not app._warning.getvalue()
+    assert card.stat().st_mtime_ns == mtime
+    assert not (tmp_path / "social_cards_cache" / "renders").exists()
+
+    # a config change that the card does not depend on
+    conf_py = (tmp_path / "conf.py").read_text(encoding="utf-8")
+    layout_opts = 'social_cards["cards_layout_options"] = {"%s": "red"}\n'
+    (tmp_path / "conf.py").write_text(conf_py + layout_opts % "accent", encoding="utf-8")
+    app = make_app(srcdir=app.srcdir)
+    app.build()
+    assert card.exists() and card.stat().st_mtime_ns == mtime
+
+    # a config change that the card depends on
+    (tmp_path / "conf.py").write_text(conf_py + layout_opts % "background_color", encoding="utf-8")
+    app = make_app(srcdir=app.srcdir)
+    app.build()
+    assert not card.exists()
+    assert len(list(card_dir.glob("index-*.png"))) == 1
+
+
+def test_shared_build_contexts(sphinx_make_app, monkeypatch: pytest.MonkeyPatch):
+    import sphinx_social_cards
+
+    calls: list[str] = []
+    get_config_context = sphinx_social_cards._get_config_context
+
+    def counted(*args):
+        calls.append("config")
+        return get_config_context(*args)
+
+    monkeypatch.setattr(sphinx_social_cards, "_get_config_context", counted)
+    app: SphinxTestApp = sphinx_make_app(
+        files={
+            "index.rst": "\nTest Title\n==========\n\n.. toctree::\n\n    other\n",
+            "other.rst": "\nOther Title\n===========\n",
+        }
+    )
+    app.build()
+    assert not app._warning.getvalue()
+    assert len(list(Path(app.outdir, "_static", "social_cards").glob("*-*.png"))) == 2
+    # the contexts that do not depend on the document are only validated once
+    assert calls == ["config"]
+
+
+def test_reused_card_size(sphinx_make_app, make_app, tmp_path: Path):
+    (tmp_path / "layouts").mkdir()
+    (tmp_path / "layouts" / "small.yml").write_text(
+        "size: { width: 600, height: 300 }\nlayers:\n  - background: { color: red }\n",
+        encoding="utf-8",
+    )
+    app: SphinxTestApp = sphinx_make_app(
+        extra_conf='social_cards["cards_layout_dir"] = ["layouts"]\n'
+        'social_cards["cards_layout"] = "small"\n',
+        files={"index.rst": "\nTest Title\n==========\n"},
+    )
+    app.build()
+    assert not app._warning.getvalue()
+    card = next(Path(app.outdir, "_static", "social_cards").glob("index-*.png"))
+    mtime = card.stat().st_mtime_ns
+
+    # the reused card's size is used in the meta data (without parsing its layout again)
+    (tmp_path / "index.rst").write_text("\nTest Title\n==========\n\nBody\n", encoding="utf-8")
+    app = make_app(srcdir=app.srcdir)
+    app.build()
+    assert card.stat().st_mtime_ns == mtime
+    html = Path(app.outdir, "index.html").read_text(encoding="utf-8")
+    assert '<meta content="600" property="og:image:width" />' in html
+    assert '<meta content="300" property="og:image:height" />' in html
+
+
+def test_prune_unrecorded_docs(sphinx_make_app):
+    from sphinx_social_cards.manifest import get_manifest, get_read_docs, prune_cards
+
+    app: SphinxTestApp = sphinx_make_app(
+        files={
+            "index.rst": "\nTest Title\n==========\n\n.. toctree::\n\n    other\n",
+            "other.rst": "\nOther Title\n===========\n",
+        }
+    )
+    app.build()
+    assert not app._warning.getvalue()
+    card = next(Path(app.outdir, "_static", "social_cards").glob("other-*.png"))
+
+    # the cards of a document that was not read (eg. by an older version) are kept
+    manifest = get_manifest(app.env)
+    for uri in [uri for uri, record in manifest.items() if record.docname == "other"]:
+        del manifest[uri]
+    get_read_docs(app.env).discard("other")
+    prune_cards(app, None)
+    assert card.exists()
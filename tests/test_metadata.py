@@ -1,3 +1,7 @@
+from pathlib import Path
+import re
+
+from PySide6.QtGui import QImage
 import pytest
 from sphinx.testing.util import SphinxTestApp
 
@@ -73,3 +77,36 @@ Test Title
     app.build()
     assert not app._warning.getvalue()
     # print(app._status.getvalue())
+
+
+@pytest.mark.parametrize(
+    "output_format,mime_type",
+    [("png8", "image/png"), ('{"format": "webp", "quality": 80}', "image/webp")],
+    ids=["png8", "webp"],
+)
+def test_output_format(sphinx_make_app, output_format: str, mime_type: str) -> None:
+    if not output_format.startswith("{"):
+        output_format = f'"{output_format}"'
+    app: SphinxTestApp = sphinx_make_app(
+        extra_conf=f'social_cards["output_format"] = {output_format}\n',
+        files={"index.rst": "Test Title\n==========\n"},
+    )
+
+    app.build()
+    assert not app._warning.getvalue()
+    suffix = "." + mime_type.split("/")[1]
+    cards = list(Path(app.outdir, "_static", "social_cards").glob("index-*"))
+    assert len(cards) == 1 and cards[0].suffix == suffix
+    html = Path(app.outdir, "index.html").read_text(encoding="utf-8")
+    meta_tags = {
+        m.group(2): m.group(1)
+        for m in re.finditer(r'<meta content="([^"]*)" property="([^"]*)"', html)
+    }
+    assert meta_tags["og:image:type"] == mime_type
+    assert meta_tags["og:image:width"] == "1200"
+    assert meta_tags["og:image:height"] == "630"
+    assert meta_tags["og:image"].endswith(cards[0].name)
+    img = QImage(str(cards[0]))
+    assert img.size().toTuple() == (1200, 630)
+    if output_format == '"png8"':
+        assert img.format() == QImage.Format.Format_Indexed8
@@ -3,7 +3,7 @@ from pathlib import Path
 from importlib.metadata import version as get_version
 import pytest
 from sphinx.testing.util import SphinxTestApp
-from sphinx_social_cards.validators import try_request
+from sphinx_social_cards.validators import Output_Format, Social_Cards, try_request
 from sphinx_social_cards.validators.common import Radial_Gradient, Offset
 from sphinx_social_cards.validators.contexts import Config, today_default
 from sphinx_social_cards.validators.layout import Size
@@ -236,3 +236,37 @@ social_cards["cards_layout_dir"] = [{repr(str(invalid))}]
 """,
         files={"index.rst": "\nTest Title\n==========\n\n.. image-generator::"},
     )
+
+
+@pytest.mark.parametrize("output_format", ["WebP", {"format": "png8", "quality": 0}])
+def test_output_format(output_format: str | dict):
+    conf = Social_Cards(site_url="https://example.com", output_format=output_format)
+    assert isinstance(conf.output_format, Output_Format)
+    assert conf.output_format.format in ("webp", "png8")
+
+
+@pytest.mark.xfail
+@pytest.mark.parametrize("output_format", ["gif", {"format": "png", "quality": 101}])
+def test_bad_output_format(output_format: str | dict):
+    Social_Cards(site_url="https://example.com", output_format=output_format)
+
+
+@pytest.mark.parametrize(
+    "doc_path,expected",
+    [
+        ("index.rst", True),
+        ("changelog.rst", False),
+        ("api-generated/module.rst", False),
+        ("api-generated/sub/module.rst", True),
+        ("blog/posts/2024/post.md", False),
+        ("blog/posts/2024/featured.md", True),
+    ],
+)
+def test_generates_card(doc_path: str, expected: bool):
+    conf = Social_Cards(
+        site_url="https://example.com",
+        cards_exclude=["changelog.rst", "*-generated/*", "blog/**/*.md"],
+        cards_include=["blog/**/featured.*"],
+    )
+    assert conf.generates_card(doc_path) is expected
+    assert not conf.model_copy(update={"enable": False}).generates_card("index.rst")